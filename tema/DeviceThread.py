@@ -1,4 +1,8 @@
 from threading import Thread
+from time import time
+
+from timing import GET_NEIGHBOURS, SCRIPT_WAIT, SCRIPT_RUN, LOCK_WAIT, BARRIER_WAIT
+from tracelog import log, DEBUG
 
 
 class DeviceThread(Thread):
@@ -18,48 +22,215 @@ class DeviceThread(Thread):
 
 
     def run(self):
-        # hope there is only one timepoint, as multiple iterations of the loop are not supported
+        # wait for the shared synchronization objects
+        self.device.setup_done.wait()
+
         while True:
+            time_point = self.device.current_timepoint
+
             # get the current neighbourhood
-            # self.device.timepoint_done.wait()
-            # self.device.timepoint_done.clear()
-
-            # print "Thread id " + str(self.device.device_id) + " waiting for master to receive script" + "\n"
-            self.device.script_received.wait()
-            self.device.script_received.clear()
-            # print "Device thread id " + str(self.device.device_id) + " master just received script" + "\n"
-            print "Thread id " + str(self.device.device_id) + " VECINII %d" %( self.device.current_timepoint) + "\n"
+            log(DEBUG, "Device %d getting neighbours on timepoint %d", self.device.device_id, time_point)
+            start = time()
             neighbours = self.device.supervisor.get_neighbours()
             if neighbours is None:
                 break
+            self.record(time_point, GET_NEIGHBOURS, start)
+
+            # replay the scripts received on previous timepoints, spread over the worker pool
+            self.submit_scripts(self.device.scripts, neighbours)
+
+            # run the scripts of this timepoint as they arrive, until the end is signaled
+            while self.receive_scripts(time_point, neighbours):
+                pass
+            self.device.workers.wait()
+
+            # no device starts the next timepoint before everybody ended this one
+            self.device.current_timepoint += 1
+            start = time()
+            self.device.time_point_barrier.wait()
+            self.record(time_point, BARRIER_WAIT, start)
+
+        self.device.workers.shutdown()
+
+    def receive_scripts(self, time_point, neighbours):
+        """
+        Waits for scripts to be assigned and submits those that arrived to the worker pool,
+        so they run while later ones are still being delivered. Scripts queued together
+        are batched together.
+
+        @type time_point: Integer
+        @param time_point: the current timepoint
+
+        @type neighbours: Tuple of Device
+        @param neighbours: the neighbours for the current timepoint
+
+        @rtype: Boolean
+        @return: False once all the scripts of the timepoint were received
+        """
+        start = time()
+        item = self.device.script_queue.get()
+        self.record(time_point, SCRIPT_WAIT, start)
+
+        scripts = []
+        while item is not None:
+            scripts.append(item)
+            if self.device.script_queue.empty():
+                break
+            item = self.device.script_queue.get()
+
+        self.device.scripts.extend(scripts)
+        self.submit_scripts(scripts, neighbours)
+        return item is not None
+
+    def submit_scripts(self, scripts, neighbours):
+        """
+        Queues scripts for execution by the worker pool.
+
+        @type scripts: List of (Script, Integer)
+        @param scripts: the scripts to run, with their locations
+
+        @type neighbours: Tuple of Device
+        @param neighbours: the neighbours for the current timepoint
+        """
+        for batch in self.split_batches(scripts):
+            self.device.workers.submit(self.run_batch, batch, neighbours)
 
+    def split_batches(self, scripts):
+        """
+        Groups the scripts by location and spreads the locations over at most one batch
+        per worker. Scripts sharing a location stay in the same batch, in order.
+
+        @type scripts: List of (Script, Integer)
+        @param scripts: the scripts to run, with their locations
+
+        @rtype: List of (List of (Integer, List of Script))
+        @return: the batches, each a list of locations with the scripts to run on them
+        """
+        by_location = {}
+        locations = []
+        for (script, location) in scripts:
+            if location not in by_location:
+                by_location[location] = []
+                locations.append(location)
+            by_location[location].append(script)
+
+        num_batches = min(len(self.device.workers.workers), len(locations))
+        batches = [[] for _ in range(num_batches)]
+        for (i, location) in enumerate(locations):
+            batches[i % num_batches].append((location, by_location[location]))
+        return batches
+
+    def run_batch(self, batch, neighbours):
+        """
+        Runs a batch of scripts on the data of this device and of its neighbours. Each
+        device is read once and written once for the whole batch, while the locks of all
+        the batch's locations are held. Called by the workers of the device's pool.
 
+        @type batch: List of (Integer, List of Script)
+        @param batch: locations with the scripts to run on them
 
-            # run scripts received until now
-            for (script, location) in self.device.scripts:
-                script_data = []
-                # collect data from current neighbours
-                for device in neighbours:
-                    data = device.get_data(location)
-                    if data is not None:
-                        script_data.append(data)
-                # add our data, if any
-                data = self.device.get_data(location)
-                if data is not None:
-                    script_data.append(data)
-
-                if script_data != []:
-                    # run script on data
-                    result = script.run(script_data)
-
-                    # update data of neighbours, hope no one is updating at the same time
-                    for device in neighbours:
-                        device.set_data(location, result)
-                    # update our data, hope no one is updating at the same time
-                    self.device.set_data(location, result)
-
-            # hope we don't get more than one script
-            # print "Device thread id " + str(self.device.device_id) + " waiting for master timepoint stop on " + str(self.device.current_timepoint - 1) + "\n"
-            self.device.timepoint_done.wait()
-            self.device.timepoint_done.clear()
-            # print "Device thread id " + str(self.device.device_id) + " master received timepoint stop" + str(self.device.current_timepoint - 1) + "\n"
+        @type neighbours: Tuple of Device
+        @param neighbours: the neighbours for the current timepoint
+        """
+        locations = [location for (location, _) in batch]
+        # the neighbours are distinct and never include this device, so every device is
+        # read and written once
+        devices = neighbours + (self.device,)
+
+        time_point = self.device.current_timepoint
+        start = time()
+        with self.device.location_locks.locked(locations):
+            self.record(time_point, LOCK_WAIT, start)
+            start = time()
+
+            # collect data from current neighbours and ours
+            gathered = [device.get_data_many(locations) for device in devices]
+
+            script_data = {}
+            for (location, _) in batch:
+                location_data = [data[location] for data in gathered if location in data]
+                if location_data != []:
+                    script_data[location] = location_data
+
+            # the n-th scripts of all the locations are independent and run in one round;
+            # a script leaves its result on every device, which the next one reads
+            results = {}
+            round_index = 0
+            while True:
+                script_round = [(scripts[round_index], location) for (location, scripts) in batch
+                                if location in script_data and round_index < len(scripts)]
+                if script_round == []:
+                    break
+                for (location, result) in self.run_round(script_round, script_data):
+                    script_data[location] = [result] * len(script_data[location])
+                    results[location] = result
+                round_index += 1
+
+            # update data of neighbours and ours
+            for (device, data) in zip(devices, gathered):
+                device.set_data_many({location : results[location] for location in data
+                                      if location in results})
+
+            self.record(time_point, SCRIPT_RUN, start)
+
+    def run_round(self, script_round, script_data):
+        """
+        Runs scripts on distinct locations. They all belong to this device and are run with
+        a single batch call, unless script results are memoized, which is done per script.
+
+        @type script_round: List of (Script, Integer)
+        @param script_round: the scripts to run, with their locations
+
+        @type script_data: Dict of Integer to (List of Float)
+        @param script_data: the data collected for each location
+
+        @rtype: List of (Integer, Float)
+        @return: the result for each location
+        """
+        if len(script_round) == 1 or self.device.script_cache is not None:
+            return [(location, self.run_script(script, location, script_data[location]))
+                    for (script, location) in script_round]
+
+        scripts = [script for (script, _) in script_round]
+        locations = [location for (_, location) in script_round]
+        results = scripts[0].run_batch([script_data[location] for location in locations],
+                                       scripts)
+        return zip(locations, results)
+
+    def run_script(self, script, location, script_data):
+        """
+        Runs a script, through the shared cache of results if there is one.
+
+        @type script: Script
+        @param script: the script to execute
+
+        @type location: Integer
+        @param location: the location for which the script is interested in
+
+        @type script_data: List of Float
+        @param script_data: the data collected for the location
+
+        @rtype: Float
+        @return: the script's result
+        """
+        if self.device.script_cache is None:
+            return script.run(script_data)
+        return self.device.script_cache.run(self.device.current_timepoint, script,
+                                            location, script_data)
+
+    def record(self, time_point, phase, start):
+        """
+        Adds the time elapsed since start to a phase of a timepoint, if the device's
+        timings are recorded.
+
+        @type time_point: Integer
+        @param time_point: the timepoint
+
+        @type phase: Integer
+        @param phase: one of the phases defined in the timing module
+
+        @type start: Float
+        @param start: when the phase began
+        """
+        if self.device.timings is not None:
+            self.device.timings.add(self.device.device_id, time_point, phase, time() - start)
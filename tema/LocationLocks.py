@@ -0,0 +1,120 @@
+"""
+This module represents the table of per-location locks shared by all devices.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2018
+"""
+
+import multiprocessing
+from contextlib import contextmanager
+from threading import Lock
+
+
+class LocationLocks(object):
+    """
+    Class that holds one lock for each location. A script holds the lock of its
+    location while it gathers, processes and scatters the data, so scripts on
+    different locations run in parallel.
+    """
+
+    def __init__(self, devices):
+        """
+        Constructor.
+
+        @type devices: List of Device
+        @param devices: the devices whose locations get a lock up front, when they keep
+            their data in a dict
+        """
+        self.locks = {}
+        self.table_lock = Lock()
+        for device in devices:
+            # iterating an array storage scans every location; get creates those locks
+            if not isinstance(device.sensor_data, dict):
+                continue
+            for location in device.sensor_data:
+                if location not in self.locks:
+                    self.locks[location] = Lock()
+
+    def get(self, location):
+        """
+        Returns the lock of a location, creating it if no device had data for it
+        during setup.
+
+        @type location: Integer
+        @param location: the location
+
+        @rtype: Lock
+        @return: the lock guarding the location's data on all devices
+        """
+        lock = self.locks.get(location)
+        if lock is None:
+            with self.table_lock:
+                lock = self.locks.setdefault(location, Lock())
+        return lock
+
+    @contextmanager
+    def locked(self, locations):
+        """
+        Holds the locks of several locations. They are taken in increasing order of the
+        location, so callers locking overlapping sets cannot deadlock.
+
+        @type locations: List of Integer
+        @param locations: the locations to lock
+        """
+        locks = [self.get(location) for location in sorted(set(locations))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+
+class StripedLocationLocks(object):
+    """
+    Class that holds a fixed number of locks shared by processes, each guarding the
+    locations equal to its index modulo the number of locks. Locations sharing a lock
+    cannot be updated in parallel, but the table needs no update after it was created.
+    """
+
+    def __init__(self, num_stripes=64):
+        """
+        Constructor.
+
+        @type num_stripes: Integer
+        @param num_stripes: the number of locks
+        """
+        self.locks = [multiprocessing.Lock() for _ in range(num_stripes)]
+
+    def get(self, location):
+        """
+        Returns the lock of a location.
+
+        @type location: Integer
+        @param location: the location
+
+        @rtype: Lock
+        @return: the lock guarding the location's data on all devices
+        """
+        return self.locks[location % len(self.locks)]
+
+    @contextmanager
+    def locked(self, locations):
+        """
+        Holds the locks of several locations. Each lock is taken once, in increasing order
+        of its index, so callers locking overlapping sets cannot deadlock.
+
+        @type locations: List of Integer
+        @param locations: the locations to lock
+        """
+        stripes = sorted(set(location % len(self.locks) for location in locations))
+        locks = [self.locks[stripe] for stripe in stripes]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
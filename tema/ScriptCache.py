@@ -0,0 +1,75 @@
+"""
+This module represents the memoization of script results shared by all devices.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2018
+"""
+
+from threading import Lock
+
+
+class ScriptCache(object):
+    """
+    Class that memoizes script results within a timepoint. A script's result only depends
+    on the data it receives, so scripts running on the same location with the same data
+    share one run. This is only correct when all the scripts of a location run the same
+    algorithm, which is why it has to be enabled explicitly.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.lock = Lock()
+        self.time_point = 0
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def run(self, time_point, script, location, script_data):
+        """
+        Returns the result of a script, running it only if no script ran on the same
+        location with the same data during this timepoint.
+
+        @type time_point: Integer
+        @param time_point: the current timepoint; a newer one drops all the results
+
+        @type script: Script
+        @param script: the script to execute
+
+        @type location: Integer
+        @param location: the location for which the script is interested in
+
+        @type script_data: List of Float
+        @param script_data: the data collected for the location
+
+        @rtype: Float
+        @return: the script's result
+        """
+        key = (location, tuple(sorted(script_data)))
+        with self.lock:
+            if time_point != self.time_point:
+                self.time_point = time_point
+                self.results = {}
+            if key in self.results:
+                self.hits += 1
+                return self.results[key]
+            self.misses += 1
+
+        result = script.run(script_data)
+
+        with self.lock:
+            if time_point == self.time_point:
+                self.results[key] = result
+        return result
+
+    def stats(self):
+        """
+        Returns the cache's counters.
+
+        @rtype: (Integer, Integer)
+        @return: the number of hits and misses
+        """
+        with self.lock:
+            return (self.hits, self.misses)
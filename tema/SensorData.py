@@ -0,0 +1,191 @@
+"""
+This module represents compact storages for the devices' sensor data.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2018
+"""
+
+import ctypes
+import mmap
+from array import array
+
+
+class ArraySensorData(object):
+    """
+    Sensor data stored in a preallocated array indexed by location, next to a presence map
+    with one byte per location. It offers the subset of the dict interface used by devices.
+    """
+
+    __slots__ = ("values", "present", "offset", "num_locations")
+
+    def __init__(self, sensor_data, num_locations):
+        """
+        Constructor.
+
+        @type sensor_data: Dict of Integer to Float
+        @param sensor_data: the initial data, by location
+
+        @type num_locations: Integer
+        @param num_locations: the number of locations in the simulation
+        """
+        self.values = array('d', [0.0]) * num_locations
+        self.present = bytearray(num_locations)
+        self.offset = 0
+        self.num_locations = num_locations
+        for (location, data) in sensor_data.items():
+            self.values[location] = data
+            self.present[location] = 1
+
+    def get(self, location, default=None):
+        """
+        Returns the data for a location.
+
+        @type location: Integer
+        @param location: the location
+
+        @return: the data, or default if this device has no data for the location
+        """
+        if location in self:
+            return self.values[self.offset + location]
+        return default
+
+    def __contains__(self, location):
+        # out of range locations would index the row of another device
+        return (0 <= location < self.num_locations and
+                self.present[self.offset + location] == 1)
+
+    def __getitem__(self, location):
+        if location not in self:
+            raise KeyError(location)
+        return self.values[self.offset + location]
+
+    def __setitem__(self, location, data):
+        if not 0 <= location < self.num_locations:
+            raise KeyError(location)
+        self.values[self.offset + location] = data
+        self.present[self.offset + location] = 1
+
+    def __iter__(self):
+        return (location for location in xrange(self.num_locations)
+                if self.present[self.offset + location])
+
+    def keys(self):
+        """
+        Returns the locations for which this device has data.
+        """
+        return list(self)
+
+    def items(self):
+        """
+        Returns the (location, data) pairs of this device.
+        """
+        return [(location, self.values[self.offset + location]) for location in self]
+
+
+class SharedSensorData(ArraySensorData):
+    """
+    Sensor data of a device kept as one row of arrays holding the data of all the devices,
+    indexed by device and location. Given arrays in shared memory, devices running in
+    different processes see each other's data.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, values, present, device_id, num_locations):
+        """
+        Constructor.
+
+        @type values: Sequence of Float
+        @param values: the data of all the devices, num_locations per device
+
+        @type present: Sequence of Integer
+        @param present: 1 where a device has data for a location, 0 elsewhere
+
+        @type device_id: Integer
+        @param device_id: the device whose row is used
+
+        @type num_locations: Integer
+        @param num_locations: the number of locations in the simulation
+        """
+        # pylint: disable=super-init-not-called
+        self.values = values
+        self.present = present
+        self.offset = device_id * num_locations
+        self.num_locations = num_locations
+
+
+class SensorStore(object):
+    """
+    Sensor data of all the devices in one dense array indexed by device and location, next
+    to a presence mask with one byte per entry. Both live in a memory map, anonymous or
+    backed by a file, so they are shared with the processes forked after the store was
+    created. Devices access their row through a SharedSensorData view.
+    """
+
+    def __init__(self, num_devices, num_locations, filename=None):
+        """
+        Constructor.
+
+        @type num_devices: Integer
+        @param num_devices: the number of devices, whose ids are between 0 and N-1
+
+        @type num_locations: Integer
+        @param num_locations: the number of locations in the simulation
+
+        @type filename: String
+        @param filename: if given, the file the store is mapped to; it holds the data once
+            the simulation ended
+        """
+        self.num_devices = num_devices
+        self.num_locations = num_locations
+        size = num_devices * num_locations
+        length = max(1, size * (ctypes.sizeof(ctypes.c_double) + 1))
+        if filename is None:
+            self.map = mmap.mmap(-1, length)
+        else:
+            with open(filename, "w+b") as map_file:
+                map_file.truncate(length)
+                self.map = mmap.mmap(map_file.fileno(), length)
+        self.values = (ctypes.c_double * size).from_buffer(self.map)
+        self.present = (ctypes.c_byte * size).from_buffer(self.map,
+                                                          size * ctypes.sizeof(ctypes.c_double))
+
+    def view(self, device_id, sensor_data=None):
+        """
+        Returns the sensor data of a device, stored in its row.
+
+        @type device_id: Integer
+        @param device_id: the device
+
+        @type sensor_data: Dict of Integer to Float
+        @param sensor_data: if given, the initial data of the device, by location
+
+        @rtype: SharedSensorData
+        @return: the device's view of the store
+        """
+        view = SharedSensorData(self.values, self.present, device_id, self.num_locations)
+        if sensor_data is not None:
+            for (location, data) in sensor_data.items():
+                view[location] = data
+        return view
+
+    def get(self, device_id, location):
+        """
+        Returns the data a device has for a location, reading only that cell.
+
+        @type device_id: Integer
+        @param device_id: the device
+
+        @type location: Integer
+        @param location: the location
+
+        @rtype: Float
+        @return: the data, or None if the device has no data for the location
+        """
+        if not 0 <= location < self.num_locations:
+            return None
+        index = device_id * self.num_locations + location
+        if self.present[index]:
+            return self.values[index]
+        return None
@@ -0,0 +1,103 @@
+"""
+This module represents the pool of worker threads that run a device's scripts.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2018
+"""
+
+from Queue import Queue
+from threading import Thread
+from traceback import format_exc
+
+
+class WorkerPool(object):
+    """
+    Fixed-size pool of worker threads fed from a shared work queue.
+    """
+
+    def __init__(self, device, num_workers):
+        """
+        Constructor.
+
+        @type device: Device
+        @param device: the device which owns this pool
+
+        @type num_workers: Integer
+        @param num_workers: the number of worker threads
+        """
+        self.tasks = Queue()
+        self.workers = [WorkerThread(device, i, self.tasks) for i in range(num_workers)]
+
+    def start(self):
+        """
+        Starts the worker threads.
+        """
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, task, *args):
+        """
+        Queues a task for execution by one of the workers.
+
+        @type task: Callable
+        @param task: the function to call
+
+        @param args: the arguments passed to task
+        """
+        self.tasks.put((task, args))
+
+    def wait(self):
+        """
+        Blocks until all the submitted tasks have been executed.
+        """
+        self.tasks.join()
+
+    def shutdown(self):
+        """
+        Stops the worker threads and waits for them to terminate.
+        """
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+class WorkerThread(Thread):
+    """
+    Class that implements a worker thread of a device's pool.
+    """
+
+    def __init__(self, device, worker_id, tasks):
+        """
+        Constructor.
+
+        @type device: Device
+        @param device: the device which owns this thread
+
+        @type worker_id: Integer
+        @param worker_id: the index of this worker in the pool
+
+        @type tasks: Queue
+        @param tasks: the queue from which tasks are taken; None stops the worker
+        """
+        Thread.__init__(self, name="Device %d Worker %d" % (device.device_id, worker_id))
+        self.device = device
+        self.tasks = tasks
+
+    def run(self):
+        while True:
+            item = self.tasks.get()
+            if item is None:
+                self.tasks.task_done()
+                break
+
+            (task, args) = item
+            try:
+                task(*args)
+            except Exception: # pylint: disable=broad-except
+                # a dead worker would leave the queued batches to the watchdog
+                self.device.supervisor.report("device %d: task failed in %s\n%s"
+                                              % (self.device.device_id, self.name, format_exc()))
+            finally:
+                self.tasks.task_done()
@@ -1,4 +1,4 @@
-import sys
+import multiprocessing
 
 from threading import *
 
@@ -83,35 +83,118 @@ class ReusableBarrierSem():
         self.threads_sem2.acquire()
 
 
-class MyThread(Thread):
-    """ Dummy thread pentru a testa comportamentul barierei """
+class SenseReversingBarrier():
+    """ Bariera reentranta cu inversarea sensului, nu depinde de trezirea tuturor inainte de reset """
 
-    def __init__(self, tid, barrier):
-        Thread.__init__(self)
-        self.tid = tid
-        self.barrier = barrier
+    def __init__(self, num_threads, action=None):
+        self.num_threads = num_threads
+        self.count_threads = self.num_threads
+        self.sense = False  # sensul fazei curente, se inverseaza la fiecare trecere
+        self.action = action  # apelata de ultimul thread ajuns, inainte de deblocare
+        self.cond = Condition()
 
-    def run(self):
-        for i in xrange(10):
-            self.barrier.wait()
-            print "I'm Thread " + str(self.tid) + " after barrier, in step " + str(i) + "\n",
+    def wait(self):
+        with self.cond:
+            my_sense = not self.sense  # sensul pe care il asteapta thread-ul in faza asta
+            self.count_threads -= 1
+            if self.count_threads == 0:
+                if self.action is not None:
+                    self.action()
+                self.count_threads = self.num_threads
+                self.sense = my_sense
+                self.cond.notify_all()
+            else:
+                while self.sense != my_sense:  # protejeaza si de trezirile false
+                    self.cond.wait()
+
+
+class TreeNode():
+    """ Nod al barierei arbore, sincronizeaza cel mult fan_in participanti """
+
+    def __init__(self, size, parent=None):
+        self.size = size
+        self.count = size
+        self.sense = False
+        self.parent = parent
+        self.cond = Condition()
+
+
+class CombiningTreeBarrier():
+    """ Bariera reentranta organizata ca arbore de noduri cu inversarea sensului """
+
+    def __init__(self, num_threads, fan_in=4, action=None):
+        if fan_in < 2:  # cu un singur copil pe nod arborele nu s-ar termina de construit
+            raise StandardError("fan_in must be at least 2, got %d" % fan_in)
+        self.num_threads = num_threads
+        self.fan_in = fan_in
+        self.action = action
+        self.local = local()  # frunza la care ajunge fiecare thread
+        self.ticket_lock = Lock()  # protejeaza alocarea frunzelor
+        self.tickets = 0
+
+        # frunzele primesc cate fan_in thread-uri, nodurile interne cate fan_in copii
+        self.leaves = self.build_level(num_threads)
+        level = self.leaves
+        while len(level) > 1:
+            parents = self.build_level(len(level))
+            for i in range(len(level)):
+                level[i].parent = parents[i // self.fan_in]
+            level = parents
+
+    def build_level(self, num_children):
+        return [TreeNode(min(self.fan_in, num_children - i))
+                for i in range(0, num_children, self.fan_in)]
 
+    def wait(self):
+        leaf = getattr(self.local, "leaf", None)
+        if leaf is None:  # prima trecere a thread-ului, ii alegem o frunza
+            with self.ticket_lock:
+                ticket = self.tickets
+                self.tickets += 1
+            leaf = self.leaves[ticket // self.fan_in]
+            self.local.leaf = leaf
+        self.arrive(leaf)
+
+    def arrive(self, node):
+        with node.cond:
+            my_sense = not node.sense
+            node.count -= 1
+            if node.count > 0:
+                while node.sense != my_sense:
+                    node.cond.wait()
+                return
+
+        # ultimul ajuns la nod il reprezinta mai sus in arbore
+        if node.parent is None:
+            if self.action is not None:
+                self.action()
+        else:
+            self.arrive(node.parent)
 
-if __name__ == "__main__":
-    if len(sys.argv) == 2:
-        num_threads = int(sys.argv[1])
-    else:
-        print "Usage: python " + sys.argv[0] + " num_threads"
-        sys.exit(0)
+        # la coborare fiecare castigator isi deblocheaza nodul
+        with node.cond:
+            node.count = node.size
+            node.sense = my_sense
+            node.cond.notify_all()
 
-    barrier = SimpleBarrier(num_threads)
-    barrier = ReusableBarrierSem(num_threads)
-    barrier = ReusableBarrierCond(num_threads)
 
-    threads = []
-    for i in xrange(num_threads):
-        threads.append(MyThread(i, barrier))
-        threads[-1].start()
+class ProcessBarrier():
+    """ Bariera reentranta intre procese, cu contorul si sensul in memorie partajata """
 
-    for t in threads:
-        t.join()
\ No newline at end of file
+    def __init__(self, num_processes):
+        self.num_processes = num_processes
+        self.count_processes = multiprocessing.Value('i', num_processes, lock=False)
+        self.sense = multiprocessing.Value('b', 0, lock=False)
+        self.cond = multiprocessing.Condition()  # protejeaza contorul si sensul
+
+    def wait(self):
+        with self.cond:
+            my_sense = 1 - self.sense.value
+            self.count_processes.value -= 1
+            if self.count_processes.value == 0:
+                self.count_processes.value = self.num_processes
+                self.sense.value = my_sense
+                self.cond.notify_all()
+            else:
+                while self.sense.value != my_sense:
+                    self.cond.wait()
@@ -0,0 +1,152 @@
+"""
+Micro-benchmark comparing the barrier implementations from barrier.py.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2018
+"""
+
+import csv
+import getopt
+import json
+import sys
+import time
+from threading import Thread
+
+from barrier import SimpleBarrier, ReusableBarrierCond, ReusableBarrierSem, \
+    SenseReversingBarrier, CombiningTreeBarrier
+
+# name -> factory(num_threads, num_iterations) returning one barrier per phase;
+# SimpleBarrier is not reentrant, so it gets a fresh instance for every phase
+BARRIERS = [
+    ("SimpleBarrier", lambda n, it: [SimpleBarrier(n) for _ in xrange(it)]),
+    ("ReusableBarrierCond", lambda n, it: [ReusableBarrierCond(n)] * it),
+    ("ReusableBarrierSem", lambda n, it: [ReusableBarrierSem(n)] * it),
+    ("SenseReversingBarrier", lambda n, it: [SenseReversingBarrier(n)] * it),
+    ("CombiningTreeBarrier/2", lambda n, it: [CombiningTreeBarrier(n, fan_in=2)] * it),
+    ("CombiningTreeBarrier/4", lambda n, it: [CombiningTreeBarrier(n, fan_in=4)] * it),
+    ("CombiningTreeBarrier/8", lambda n, it: [CombiningTreeBarrier(n, fan_in=8)] * it),
+]
+
+FIELDS = ["barrier", "threads", "iterations", "median_us", "p99_us", "wall_s"]
+
+
+class BenchThread(Thread):
+    """
+    Thread that passes through the barrier once per phase, recording when it
+    arrived and when it was released.
+    """
+
+    def __init__(self, barriers):
+        Thread.__init__(self)
+        self.barriers = barriers
+        self.arrivals = []
+        self.releases = []
+
+    def run(self):
+        for barrier in self.barriers:
+            self.arrivals.append(time.time())
+            barrier.wait()
+            self.releases.append(time.time())
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the sorted values lies.
+    """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_barrier(factory, num_threads, num_iterations):
+    """
+    Runs one barrier configuration.
+
+    A phase's latency is the time between the last thread arriving and the
+    last thread being released.
+
+    @rtype: (Float, Float, Float)
+    @return: median and p99 phase latency in microseconds, and wall time in seconds
+    """
+    barriers = factory(num_threads, num_iterations)
+    threads = [BenchThread(barriers) for _ in xrange(num_threads)]
+
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.time() - start
+
+    latencies = sorted(max(t.releases[i] for t in threads) - max(t.arrivals[i] for t in threads)
+                       for i in xrange(num_iterations))
+    return (1e6 * percentile(latencies, 0.5), 1e6 * percentile(latencies, 0.99), wall_time)
+
+
+def write_results(results, filename):
+    """
+    Writes the result rows as JSON if the file name ends in .json, as CSV otherwise.
+    """
+    with open(filename, "w") as out_file:
+        if filename.endswith(".json"):
+            json.dump(results, out_file, indent=2)
+        else:
+            writer = csv.DictWriter(out_file, FIELDS)
+            writer.writerow(dict(zip(FIELDS, FIELDS)))
+            writer.writerows(results)
+
+
+def usage(argv):
+    print "Usage: python %s [OPTIONS]" % argv[0]
+    print "options:"
+    print "\t-t,   --threads\tcomma separated thread counts, defaults to 2,4,...,256"
+    print "\t-i,   --iterations\tcomma separated phase counts, defaults to 100,1000"
+    print "\t-b,   --barrier\tonly run barriers whose name contains this string"
+    print "\t-o,   --out\t\toutput file, .json or .csv, defaults to barriers.csv"
+    print "\t-h,   --help\t\tprint this help screen"
+
+
+def main():
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], "ht:i:b:o:",
+                                ["help", "threads=", "iterations=", "barrier=", "out="])
+    except getopt.GetoptError, err:
+        print str(err)
+        usage(sys.argv)
+        sys.exit(2)
+
+    thread_counts = [2, 4, 8, 16, 32, 64, 128, 256]
+    iteration_counts = [100, 1000]
+    name_filter = ""
+    output_file = "barriers.csv"
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage(sys.argv)
+            sys.exit(0)
+        elif opt in ("-t", "--threads"):
+            thread_counts = [int(n) for n in arg.split(",")]
+        elif opt in ("-i", "--iterations"):
+            iteration_counts = [int(n) for n in arg.split(",")]
+        elif opt in ("-b", "--barrier"):
+            name_filter = arg
+        elif opt in ("-o", "--out"):
+            output_file = arg
+
+    results = []
+    print "%-24s %8s %10s %12s %12s %10s" % tuple(FIELDS)
+    for (name, factory) in BARRIERS:
+        if name_filter not in name:
+            continue
+        for num_threads in thread_counts:
+            for num_iterations in iteration_counts:
+                (median, p99, wall_time) = run_barrier(factory, num_threads, num_iterations)
+                results.append(dict(zip(FIELDS, [name, num_threads, num_iterations,
+                                                 median, p99, wall_time])))
+                print "%-24s %8d %10d %12.1f %12.1f %10.3f" % (name, num_threads, num_iterations,
+                                                              median, p99, wall_time)
+
+    write_results(results, output_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Clocks used by the testing infrastructure for the script and delivery delays.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2018
+"""
+
+import heapq
+import time
+from threading import Condition, Event, Thread
+
+
+class RealClock(object):
+    """
+    The wall clock; delays are real sleeps.
+    """
+
+    def start(self):
+        """
+        Nothing to start for the wall clock.
+        """
+        pass
+
+    def shutdown(self):
+        """
+        Nothing to stop for the wall clock.
+        """
+        pass
+
+    @staticmethod
+    def time():
+        """
+        @rtype: Float
+        @return: the current time, in seconds
+        """
+        return time.time()
+
+    @staticmethod
+    def sleep(delay):
+        """
+        Blocks the calling thread.
+
+        @type delay: Float
+        @param delay: the delay in seconds
+        """
+        time.sleep(delay)
+
+
+class VirtualClock(object):
+    """
+    Simulated clock for discrete-event runs. Threads waiting on it do not sleep: once no new
+    event was scheduled for a short grace period, the clock jumps to the earliest pending
+    event and runs it. A run thus takes the time of its computation instead of the time of
+    its delays.
+
+    The clock does not know whether the simulation threads are done reacting to the last
+    event, it only assumes so after the grace period. This is not deterministic: a thread
+    still computing when the period ends, e.g. on a loaded machine, is overtaken by the
+    clock, so the order of events and the simulated times can differ from run to run.
+    A longer grace period makes this less likely and the run slower.
+
+    Events are run by the clock's own thread, so they must not block.
+    """
+
+    def __init__(self, grace=0.002):
+        """
+        Constructor.
+
+        @type grace: Float
+        @param grace: the real time, in seconds, without new events after which the
+            clock advances
+        """
+        self.now = 0.0
+        self.grace = grace
+        self.queue = []
+        self.seq = 0
+        # timers do not advance the clock, they fire once it got past them
+        self.timers = []
+        self.stopped = False
+        self.cond = Condition()
+        self.thread = Thread(name="Virtual Clock", target=self.__run)
+
+    def start(self):
+        """
+        Starts the thread advancing the clock.
+        """
+        self.thread.start()
+
+    def shutdown(self):
+        """
+        Stops the clock; pending events are dropped.
+        """
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.thread.join()
+
+    def time(self):
+        """
+        @rtype: Float
+        @return: the simulated time, in seconds since the clock was created
+        """
+        return self.now
+
+    def sleep(self, delay):
+        """
+        Blocks the calling thread until the simulated time advanced by delay.
+
+        @type delay: Float
+        @param delay: the delay in seconds
+        """
+        wake_up = Event()
+        self.call_later(delay, wake_up.set)
+        wake_up.wait()
+
+    def call_later(self, delay, function, *args):
+        """
+        Schedules a function to run on the clock's thread after a simulated delay.
+
+        @type delay: Float
+        @param delay: the delay in seconds
+        @type function: Callable
+        @param function: the function to call
+        """
+        with self.cond:
+            # seq keeps functions with the same due time in scheduling order
+            heapq.heappush(self.queue, (self.now + delay, self.seq, function, args))
+            self.seq += 1
+            self.cond.notify()
+
+    def timer(self, delay, function, *args):
+        """
+        Schedules a function to run once the simulated time passes a delay. Unlike
+        call_later, the timer alone does not make the clock advance.
+
+        @type delay: Float
+        @param delay: the delay in seconds
+        @type function: Callable
+        @param function: the function to call
+
+        @rtype: Object
+        @return: the timer, to be given to cancel
+        """
+        timer = (self.now + delay, function, args)
+        with self.cond:
+            self.timers.append(timer)
+        return timer
+
+    def cancel(self, timer):
+        """
+        Cancels a timer that did not fire yet.
+
+        @type timer: Object
+        @param timer: the value returned by timer
+        """
+        with self.cond:
+            if timer in self.timers:
+                self.timers.remove(timer)
+
+    def __run(self):
+        while True:
+            with self.cond:
+                while not self.stopped:
+                    if not self.queue:
+                        self.cond.wait()
+                        continue
+                    seq = self.seq
+                    self.cond.wait(self.grace)
+                    if seq == self.seq:
+                        break
+                if self.stopped:
+                    return
+                self.now = max(self.now, self.queue[0][0])
+                due = []
+                while self.queue and self.queue[0][0] <= self.now:
+                    (_, _, function, args) = heapq.heappop(self.queue)
+                    due.append((function, args))
+                for timer in [timer for timer in self.timers if timer[0] <= self.now]:
+                    self.timers.remove(timer)
+                    due.append(timer[1:])
+            for (function, args) in due:
+                function(*args)
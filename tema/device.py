@@ -6,17 +6,30 @@ Assignment 1
 March 2018
 """
 
+from Queue import Queue
 from threading import Event
 
 from DeviceThread import DeviceThread
-from barrier import *
+from LocationLocks import LocationLocks
+from ScriptCache import ScriptCache
+from SensorData import ArraySensorData
+from WorkerPool import WorkerPool
+from barrier import CombiningTreeBarrier
+from tracelog import log, DEBUG
 
 class Device(object):
     """
     Class that represents a device.
     """
 
-    def __init__(self, device_id, sensor_data, supervisor):
+    __slots__ = ("device_id", "sensor_data", "supervisor", "scripts", "script_queue",
+                 "setup_done", "location_locks", "time_point_barrier", "workers", "thread",
+                 "current_timepoint", "memoize_scripts", "script_cache", "timings",
+                 "process_barrier")
+
+    def __init__(self, device_id, sensor_data, supervisor, num_workers=8, num_locations=None,
+                 memoize_scripts=False, timings=None, location_locks=None,
+                 process_barrier=None):
         """
         Constructor.
 
@@ -28,13 +41,45 @@ class Device(object):
 
         @type supervisor: Supervisor
         @param supervisor: the testing infrastructure's control and validation component
+
+        @type num_workers: Integer
+        @param num_workers: the number of threads running this device's scripts
+
+        @type num_locations: Integer
+        @param num_locations: if given, the sensor data is kept in an array of this size
+            indexed by location instead of a dict
+
+        @type memoize_scripts: Boolean
+        @param memoize_scripts: if set on the device with the lowest id, scripts on the same
+            location with the same data share one run within a timepoint
+
+        @type timings: TimingRecorder
+        @param timings: if given, records the time this device spends in each phase of
+            every timepoint
+
+        @type location_locks: StripedLocationLocks
+        @param location_locks: if given on the device with the lowest id, the location locks
+            handed to the devices, shared with devices running in other processes
+
+        @type process_barrier: ProcessBarrier
+        @param process_barrier: if given on the device with the lowest id, the devices of
+            this process end a timepoint together with those of the other processes
         """
         self.device_id = device_id
+        if num_locations is not None:
+            sensor_data = ArraySensorData(sensor_data, num_locations)
         self.sensor_data = sensor_data
         self.supervisor = supervisor
-        self.script_received = Event()
         self.scripts = []
-        self.timepoint_done = Event()
+        self.script_queue = Queue()
+        self.setup_done = Event()
+        self.location_locks = location_locks
+        self.time_point_barrier = None
+        self.memoize_scripts = memoize_scripts
+        self.script_cache = None
+        self.timings = timings
+        self.process_barrier = process_barrier
+        self.workers = WorkerPool(self, num_workers)
         self.thread = DeviceThread(self)
         self.current_timepoint = 0
 
@@ -54,8 +99,25 @@ class Device(object):
         @type devices: List of Device
         @param devices: list containing all devices
         """
-        self.script_received.clear()
-        self.timepoint_done.clear()
+        # the device with the lowest id creates the shared synchronization
+        # objects and hands them to everybody
+        if self.device_id == min(device.device_id for device in devices):
+            location_locks = self.location_locks
+            if location_locks is None:
+                location_locks = LocationLocks(devices)
+            # the last device of this process to arrive waits for the other processes
+            barrier_action = None
+            if self.process_barrier is not None:
+                barrier_action = self.process_barrier.wait
+            time_point_barrier = CombiningTreeBarrier(len(devices), action=barrier_action)
+            script_cache = ScriptCache() if self.memoize_scripts else None
+            for device in devices:
+                device.location_locks = location_locks
+                device.time_point_barrier = time_point_barrier
+                device.script_cache = script_cache
+                device.setup_done.set()
+
+        self.workers.start()
         self.thread.start()
 
     def assign_script(self, script, location):
@@ -69,18 +131,14 @@ class Device(object):
         @type location: Integer
         @param location: the location for which the script is interested in
         """
+        # the device thread hands the script to the workers as soon as it takes it
+        # from the queue, and keeps it to run again at every later timepoint
         if script is not None:
-            self.scripts.append((script, location))
-            print "Device " + str(self.device_id) + " received script " + str(script) + " location " + str(location) + "\n"
-            self.script_received.set()
+            log(DEBUG, "Device %d received script %s location %d", self.device_id, script, location)
+            self.script_queue.put((script, location))
         else:
-            print "Device " + str(self.device_id) + " received NONE on timepoint " + str(self.current_timepoint) + "\n"
-            self.time_point_barrier.wait()
-            # print "Device " + str(self.device_id) + " terminat asteptarea" + "\n"
-            self.current_timepoint +=1
-            self.script_received.set()
-            self.timepoint_done.set()
-            # print "Device " + str(self.device_id) + " incepe timepoint-ul " + str(self.current_timepoint) + "\n"
+            log(DEBUG, "Device %d received NONE on timepoint %d", self.device_id, self.current_timepoint)
+            self.script_queue.put(None)
 
     def get_data(self, location):
         """
@@ -92,7 +150,7 @@ class Device(object):
         @rtype: Float
         @return: the pollution value
         """
-        return self.sensor_data[location] if location in self.sensor_data else None
+        return self.sensor_data.get(location)
 
     def set_data(self, location, data):
         """
@@ -107,6 +165,34 @@ class Device(object):
         if location in self.sensor_data:
             self.sensor_data[location] = data
 
+    def get_data_many(self, locations):
+        """
+        Returns the pollution values this device has for several locations. The caller
+        holds the locks of all the locations, taken once for the whole batch.
+
+        @type locations: List of Integer
+        @param locations: the locations for which to obtain the data
+
+        @rtype: Dict of Integer to Float
+        @return: the pollution values, only for the locations this device has data for
+        """
+        sensor_data = self.sensor_data
+        return {location : sensor_data[location] for location in locations
+                if location in sensor_data}
+
+    def set_data_many(self, values):
+        """
+        Sets the pollution values stored by this device for several locations. The caller
+        holds the locks of all the locations, taken once for the whole batch.
+
+        @type values: Dict of Integer to Float
+        @param values: the pollution values, by location
+        """
+        sensor_data = self.sensor_data
+        for (location, data) in values.items():
+            if location in sensor_data:
+                sensor_data[location] = data
+
     def shutdown(self):
         """
         Instructs the device to shutdown (terminate all threads). This method
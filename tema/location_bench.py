@@ -0,0 +1,124 @@
+"""
+Stress benchmark for the per-location locks: every device of the sharing test
+repeatedly runs a script on the same hot location.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2018
+"""
+
+import getopt
+import sys
+import time
+
+from LocationLocks import LocationLocks
+from device import Device
+from supervisor import Runtime, Supervisor
+from test import TestCase
+from timing import LOCK_WAIT, TimingRecorder
+
+
+def run_benchmark(num_rounds, time_point, num_workers):
+    """
+    Runs the benchmark and prints the throughput. Each device runs its scripts of
+    timepoint 0 as batches on its worker pool, like the device thread does, so every run
+    goes through the location locks, DeviceThread.run_batch and Script.run.
+
+    @type num_rounds: Integer
+    @param num_rounds: the number of batches run by each device
+
+    @type time_point: Integer
+    @param time_point: the timepoint whose encounters give the neighbours
+
+    @type num_workers: Integer
+    @param num_workers: the number of worker threads of each device
+    """
+    test = TestCase.create_sharing1_test_case()
+    # the script delay would hide the time spent on the locks
+    test.script_sleep = None
+    supervisor = Supervisor(test)
+    timings = TimingRecorder()
+    devices = [Device(dev.id, dict(dev.locations), Runtime(supervisor, dev.id), num_workers,
+                      timings=timings)
+               for dev in test.devices]
+
+    # the shared objects setup_devices hands out, without starting the device threads
+    location_locks = LocationLocks(devices)
+    for device in devices:
+        device.location_locks = location_locks
+
+    batches = []
+    for device in devices:
+        scripts = supervisor.scripts[0][device.device_id]
+        if scripts == []:
+            continue
+        neighbours = tuple(devices[i] for i in
+                           supervisor.neighbour_ids.get((device.device_id, time_point), ()))
+        batch = device.thread.split_batches([(script_rd.script, script_rd.location)
+                                             for script_rd in scripts])
+        batches.append((device, batch, neighbours))
+
+    for device in devices:
+        device.workers.start()
+
+    start = time.time()
+    for _ in xrange(num_rounds):
+        for (device, batch, neighbours) in batches:
+            for location_batch in batch:
+                device.workers.submit(device.thread.run_batch, location_batch, neighbours)
+    for device in devices:
+        device.workers.wait()
+    elapsed = time.time() - start
+
+    for device in devices:
+        device.workers.shutdown()
+
+    num_scripts = num_rounds * sum(len(supervisor.scripts[0][device.device_id])
+                                   for (device, _, _) in batches)
+    lock_wait = sum(row[LOCK_WAIT] for row in timings.records.values())
+    print "%s: %d devices, %d scripts on one location" % (test.name, len(batches), num_scripts)
+    print "wall time          %.3f s" % elapsed
+    print "throughput         %.0f scripts/s" % (num_scripts / elapsed)
+    print "mean lock wait     %.3f ms" % (1000.0 * lock_wait / num_scripts)
+    for msg in supervisor.status():
+        print >> sys.stderr, msg
+
+
+def usage(argv):
+    print "Usage: python %s [OPTIONS]" % argv[0]
+    print "options:"
+    print "\t-r,   --rounds\t\tscripts run by each device, defaults to 1000"
+    print "\t-t,   --timepoint\ttimepoint whose encounters are used, defaults to 1"
+    print "\t-w,   --workers\t\tworker threads of each device, defaults to 8"
+    print "\t-h,   --help\t\tprint this help screen"
+
+
+def main():
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], "hr:t:w:",
+                                   ["help", "rounds=", "timepoint=", "workers="])
+    except getopt.GetoptError, err:
+        print str(err)
+        usage(sys.argv)
+        sys.exit(2)
+
+    num_rounds = 1000
+    time_point = 1
+    num_workers = 8
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage(sys.argv)
+            sys.exit(0)
+        elif opt in ("-r", "--rounds"):
+            num_rounds = int(arg)
+        elif opt in ("-t", "--timepoint"):
+            time_point = int(arg)
+        elif opt in ("-w", "--workers"):
+            num_workers = int(arg)
+
+    run_benchmark(num_rounds, time_point, num_workers)
+
+
+if __name__ == "__main__":
+    main()
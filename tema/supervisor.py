@@ -6,19 +6,35 @@ Assignment 1
 March 2018
 """
 
+import heapq
+import multiprocessing
 import os
 import random
 import sys
 import time
 import threading
 
+import tracelog
+from LocationLocks import StripedLocationLocks
+from SensorData import SensorStore
+from barrier import ProcessBarrier
+from clock import RealClock, VirtualClock
 from collections import namedtuple
+from itertools import chain
 from device import Device
+from timing import TimingRecorder
 from random import shuffle, uniform
-from threading import current_thread, Event, Semaphore, Thread
-from time import sleep
+from threading import current_thread, Condition, Event, Lock, Thread, Timer
 from traceback import print_stack
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Batches from which Script.run_batch computes with numpy
+NUMPY_BATCH_MIN = 16
+
 
 class Supervisor(object):
     """
@@ -44,16 +60,47 @@ class Supervisor(object):
         self.setup_event = Event()
         self.start_event = Event()
         self.devices = {}
-        self.threads = {}
-        self.waits = {}
+        # the DeviceRunData of the devices run by this process
+        self.running = []
+        self.deliveries = {}
+        # the data of all the devices, when they keep it in a central store
+        self.store = None
+        self.dispatcher = None
+        self.timings = None
         self.die_on_error = die_on_error
         self.banned_threads = set()
         self.messages = []
+        if self.testcase.options.virtual_time:
+            self.clock = VirtualClock(self.testcase.options.virtual_grace)
+            self.register_banned_thread(self.clock.thread)
+        else:
+            self.clock = RealClock()
+        # timepoint -> clock time when the first device started it
+        self.timepoint_starts = {}
         self.scripts = {i : {j : [] for j in range(len(self.testcase.devices))} for i in range(self.testcase.duration + self.testcase.extra_duration)}
         for script_td in self.testcase.scripts:
             script = Script(self.testcase.script_sleep)
             script._Script__set_supervisor(self)
             self.scripts[script_td.time_point][script_td.device].append(ScriptRunData(script=script, location=script_td.location))
+        # (device_id, time_point) -> neighbour ids, built once from the encounters; each
+        # neighbour appears once and a device is never its own neighbour
+        self.neighbour_ids = {}
+        for device_td in self.testcase.devices:
+            encountered = {}
+            for enc in device_td.encounters:
+                encountered.setdefault(enc.time_point, set()).update(enc.devices)
+            for (time_point, ids) in encountered.items():
+                ids.discard(device_td.id)
+                if ids:
+                    self.neighbour_ids[(device_td.id, time_point)] = tuple(sorted(ids))
+        # (device_id, time_point) -> neighbour devices, built once the devices exist
+        self.neighbours = {}
+        # the tester already checked that numpy is available
+        if self.testcase.options.reference_engine == "numpy":
+            self.reference = NumpyReferenceModel(self.testcase, self.scripts, self.neighbour_ids)
+        else:
+            self.reference = ReferenceModel(self.testcase, self.scripts, self.neighbour_ids)
+        self.validation_lock = threading.Lock()
 
     def register_banned_thread(self, thread=None):
         """
@@ -100,58 +147,36 @@ tester thread '%s'" % (str(device), method, thread.name))
             self.report("thread '%s' did not terminate"
                         % str(thrd.name), die_on_error=False)
 
-    def validate(self, crt_timepoint):
+    def validate(self, crt_timepoint, final=True):
         """
         !!! This is not part of the assignment API, do not call it !!!
 
-        Validates the current state of the data.
+        Validates the current state of the data. The reference data is advanced
+        incrementally, so timepoints must be validated in increasing order.
+
+        @type final: Boolean
+        @param final: false for the check of an intermediate timepoint, whose state may
+            legitimately depend on the order of the scripts; its differences are only
+            printed as warnings and do not fail the test
         """
-        data = {}
-        for device_testdata in self.testcase.devices:
-            device_id = device_testdata.id
-            sensor_data = {loc : data for (loc, data) in device_testdata.locations}
-            data[device_id] = sensor_data
-
-        for tpt in range(crt_timepoint + 1):
-            # print "timepoint %d" % tpt
-            # for (dev, dat) in data.items():
-            #     print "dev: %d %s" % (dev, str(dat))
-
-            for run_tpt in range(tpt + 1):
-                for (dev, scripts) in self.scripts[run_tpt].items():
-                    for script_rd in scripts:
-                        scrpt = script_rd.script
-                        location = script_rd.location
-                        neighbour_ids = self.__compute_neighbour_ids(dev, tpt)
-
-                        # print "dev: %d %s" % (dev, neighbour_ids)
-
-                        script_data = []
-                        # collect data from current neighbours
-                        for neigh in neighbour_ids:
-                            if location in data[neigh]:
-                                script_data.append(data[neigh][location])
-                        # add our data, if any
-                        if location in data[dev]:
-                            script_data.append(data[dev][location])
-
-                        # run script on data
-                        if script_data != []:
-                            result = scrpt._Script__update(script_data)
-
-                            # update data of neighbours
-                            for neigh in neighbour_ids:
-                                if location in data[neigh]:
-                                    data[neigh][location] = result
-                            # update our data
-                            if location in data[dev]:
-                                data[dev][location] = result
-
-        for (dev_id, sens_data) in data.items():
-            for (loc, ref_data) in sens_data.items():
-                calc_data = self.devices[dev_id].device.get_data(loc)
-                if ref_data != calc_data:
-                    self.report("after timepoint %d, data for location %d on device %d differs: expected %f, found %f\n" % (crt_timepoint, loc, dev_id, ref_data, calc_data))
+        self.reference.advance(crt_timepoint)
+
+        # the store is read directly, only at the cells the reference has data for
+        if self.store is not None:
+            get_data = self.store.get
+        else:
+            get_data = lambda dev_id, loc: self.devices[dev_id].device.get_data(loc)
+
+        for (dev_id, loc, ref_data) in self.reference.values():
+            calc_data = get_data(dev_id, loc)
+            if ref_data != calc_data and not final:
+                print >> sys.stderr, ("warning: after timepoint %d, data for location %d on "
+                                      "device %d differs: expected %f, found %s\n"
+                                      % (crt_timepoint, loc, dev_id, ref_data, calc_data)),
+            elif ref_data != calc_data:
+                self.report("after timepoint %d, data for location %d on device %d differs: "
+                            "expected %f, found %f\n"
+                            % (crt_timepoint, loc, dev_id, ref_data, calc_data))
 
     def report(self, message, die_on_error=None):
         """
@@ -189,44 +214,20 @@ tester thread '%s'" % (str(device), method, thread.name))
         setup_event.wait()
         device.setup_devices(neighbours)
     
-    @staticmethod
-    def __send_scripts(device, scripts, delay, wait):
-        time.sleep(delay)
-        for script_rd in scripts:
-            if script_rd is scripts[-1]:
-                time.sleep(delay)
-            device.assign_script(script_rd.script, script_rd.location)
-        wait.release()
-
-    @staticmethod
-    def __send_end(device, wait, count):
-        for i in range(count):
-            wait.acquire()
-        device.assign_script(None, None)
-
-    def __compute_neighbour_ids(self, device_id, time_point):
-        neighbours = set()
-        # ugly linear search is ugly
-        for enc in self.testcase.devices[device_id].encounters:
-            if enc.time_point != time_point:
-                continue
-            neighbours |= set(enc.devices)
-        return list(neighbours)
-
     def get_neighbours(self, device_id):
         """
         !!! This is not part of the assignment API, do not call it !!!
 
-        Returns the list of neighbours for device_id for the current timepoint, and increments the
-        timepoint for the next invocation. This method is wrapped by Runtime.
+        Returns the neighbours of device_id for the current timepoint, and increments the
+        timepoint for the next invocation. The device itself is not among them. This method is wrapped by Runtime.
         WARNING: this method is not thread-safe and must not be called concurrently with
         the same device_id.
 
         @type device_id: Integer
         @param device_id: the id of the device for which neighbours must be returned
 
-        @rtype: List of device.Device
-        @return: the list of neighbours for the current timepoint
+        @rtype: Tuple of device.Device
+        @return: the neighbours for the current timepoint, each given once
         """
         self.start_event.wait()
 
@@ -235,12 +236,12 @@ tester thread '%s'" % (str(device), method, thread.name))
 
         self.check_execution("get_neighbours", device)
 
-        for dev_rd in self.devices.values():
+        for dev_rd in self.running:
             if dev_rd.crt_timepoint < crt_timepoint or dev_rd.crt_timepoint > crt_timepoint + 1:
                 self.report("device %d called 'get_neighbours' on time %d expected was %d. My time was %d\n" % (device_id, dev_rd.crt_timepoint, crt_timepoint, device.current_timepoint), True)
 
-        for thrd in self.threads[device_id]:
-                    thrd.join()
+        if device_id in self.deliveries:
+            self.deliveries[device_id].done.wait()
 
         if crt_timepoint == self.testcase.duration + self.testcase.extra_duration:
             return None
@@ -248,9 +249,16 @@ tester thread '%s'" % (str(device), method, thread.name))
         if crt_timepoint > self.testcase.duration + self.testcase.extra_duration:
             self.report("called 'get_neighbours' from device %d, on timepoint %d, after simulation end at %d\n" % (device_id, crt_timepoint, self.testcase.duration + self.testcase.extra_duration), True)
 
-        neighbour_ids = self.__compute_neighbour_ids(device_id, crt_timepoint)
+        # the first device to start a timepoint checks the previous one, while
+        # everybody else is still held at the barrier or on this lock
+        if self.testcase.options.validate_each_timepoint and crt_timepoint > 0:
+            with self.validation_lock:
+                if self.reference.time_point < crt_timepoint - 1:
+                    self.validate(crt_timepoint - 1, final=False)
+
+        self.timepoint_starts.setdefault(crt_timepoint, self.clock.time())
 
-        neighbours = [self.devices[neigh_id].device for neigh_id in neighbour_ids]
+        neighbours = self.neighbours.get((device_id, crt_timepoint), ())
 
         scripts = self.scripts[crt_timepoint][device_id]
 
@@ -262,48 +270,71 @@ tester thread '%s'" % (str(device), method, thread.name))
         else:
             scripts = [scripts]
 
-        self.waits[device_id] = Semaphore(0)
-
-        self.threads[device_id] = []
-        for scrpt in scripts:
-            delay_min = self.testcase.script_delay[0]
-            delay_max = self.testcase.script_delay[1]
-            thread = Thread(name="Sender",
-                            target=Supervisor.__send_scripts,
-                            args=(device, scrpt, random.uniform(delay_min, delay_max), self.waits[device_id]))
-            self.register_banned_thread(thread)
-            self.threads[device_id].append(thread)
-            thread.start()
-
-        thread = Thread(name="Ender",
-                        target=Supervisor.__send_end,
-                        args=(device, self.waits[device_id], len(scripts)))
-        self.threads[device_id].append(thread)
-        thread.start()
+        delay_min = self.testcase.script_delay[0]
+        delay_max = self.testcase.script_delay[1]
+        delays = [random.uniform(delay_min, delay_max) for _ in scripts]
+        self.deliveries[device_id] = ScriptDelivery(device, scripts)
+        self.deliveries[device_id].start(self.dispatcher, delays)
 
         self.devices[device_id].crt_timepoint = crt_timepoint + 1
 
         return neighbours
 
-    def run_testcase(self):
+    def report_makespans(self, end_time):
         """
         !!! This is not part of the assignment API, do not call it !!!
 
-        Runs the test case by creating the devices, unblocking the script assignment and waiting
-        for device termination.
+        Prints the simulated time taken by each timepoint, from its start by the first
+        device to the start of the next one.
 
-        @rtype: Integer
-        @return: the number of errors
+        @type end_time: Float
+        @param end_time: the clock time when all the devices terminated
         """
-        for device_testdata in self.testcase.devices:
-            device_id = device_testdata.id
-            sensor_data = {loc : data for (loc, data) in device_testdata.locations}
-            supervisor = Runtime(self, device_id)
-            device = Device(device_id, sensor_data, supervisor)
-            self.devices[device_id] = DeviceRunData(device=device, crt_timepoint=0)
-            self.threads[device_id] = []
+        starts = [self.timepoint_starts[tpt] for tpt in sorted(self.timepoint_starts)]
+        makespans = [end - start for (start, end) in zip(starts, starts[1:] + [end_time])]
+        print "Simulated makespan %.3f s, per timepoint: %s" % (
+            end_time, " ".join("%.3f" % makespan for makespan in makespans))
+
+    def report_cache_stats(self, script_cache):
+        """
+        !!! This is not part of the assignment API, do not call it !!!
+
+        Prints how many script runs the devices' shared cache of results saved.
+
+        @type script_cache: ScriptCache
+        @param script_cache: the cache shared by the devices
+        """
+        (hits, misses) = script_cache.stats()
+        print "Script cache: %d hits, %d misses" % (hits, misses)
+
+    def __iteration_file(self, filename):
+        """
+        Returns the name of an output file of this iteration.
+
+        @type filename: String
+        @param filename: the name given in the options; a %d in it is replaced by the iteration
+
+        @rtype: String
+        @return: the file name
+        """
+        if "%d" in filename:
+            filename = filename % (self.testcase.crt_iteration or 0)
+        return filename
+
+    def __run_devices(self, devices):
+        """
+        Runs devices in this process, from their setup to their termination.
+
+        @type devices: List of device.Device
+        @param devices: the devices to run
+        """
+        self.running = [self.devices[dev.device_id] for dev in devices]
+
+        self.clock.start()
+        virtual_clock = self.clock if self.testcase.options.virtual_time else None
+        self.dispatcher = ScriptDispatcher(self, self.testcase.options.sender_threads,
+                                           virtual_clock)
 
-        devices = [device_rd.device for device_rd in self.devices.values()]
         setup_threads = []
         for dev in devices:
             neighbours = devices[:]
@@ -320,11 +351,109 @@ tester thread '%s'" % (str(device), method, thread.name))
 
         self.start_event.set()
 
-        for dev in self.devices.values():
-            dev.device.shutdown()
+        for dev in devices:
+            dev.shutdown()
+
+        self.dispatcher.shutdown()
+        end_time = self.clock.time()
+        self.clock.shutdown()
+        tracelog.flush()
+
+        if self.testcase.options.virtual_time:
+            self.report_makespans(end_time)
+
+        if self.testcase.options.memoize_scripts:
+            self.report_cache_stats(devices[0].script_cache)
+
+        if self.timings is not None:
+            self.timings.dump(self.__iteration_file(self.testcase.options.timings_file))
 
         self.check_termination()
 
+    def __run_shards(self, shards):
+        """
+        Runs each group of devices in a process of its own, and waits for them. The
+        processes share the devices' data, location locks and timepoint barrier.
+
+        @type shards: List of (List of device.Device)
+        @param shards: the devices run by each process
+        """
+        processes = []
+        for (i, devices) in enumerate(shards):
+            processes.append(multiprocessing.Process(name="Shard %d" % i,
+                                                     target=self.__run_shard,
+                                                     args=(devices,)))
+            processes[-1].start()
+
+        for process in processes:
+            process.join()
+            if process.exitcode != 0:
+                self.report("%s ended with exit code %d\n" % (process.name, process.exitcode),
+                            die_on_error=False)
+
+    def __run_shard(self, devices):
+        # the tester's watchdog only runs in the parent process
+        watchdog = Timer(self.testcase.timeout, os.abort)
+        self.register_banned_thread(watchdog)
+        watchdog.start()
+
+        self.__run_devices(devices)
+
+        watchdog.cancel()
+        for msg in self.status():
+            print >> sys.stderr, msg
+        sys.exit(len(self.status()))
+
+    def run_testcase(self):
+        """
+        !!! This is not part of the assignment API, do not call it !!!
+
+        Runs the test case by creating the devices, unblocking the script assignment and waiting
+        for device termination.
+
+        @rtype: Integer
+        @return: the number of errors
+        """
+        tracelog.set_level(self.testcase.options.log_level)
+
+        # the tester already checked that the options fit a sharded run
+        num_shards = min(self.testcase.options.shards, len(self.testcase.devices))
+
+        device_options = {"num_workers" : self.testcase.options.num_workers,
+                          "memoize_scripts" : self.testcase.options.memoize_scripts}
+        if self.testcase.options.timings_file:
+            self.timings = TimingRecorder()
+            device_options["timings"] = self.timings
+        # shards share the data of all the devices through the store
+        if num_shards > 1 or self.testcase.options.sensor_storage == "store":
+            store_file = self.__iteration_file(self.testcase.options.store_file) or None
+            self.store = SensorStore(len(self.testcase.devices), self.testcase.num_locations,
+                                     store_file)
+        elif self.testcase.options.sensor_storage == "array":
+            device_options["num_locations"] = self.testcase.num_locations
+        if num_shards > 1:
+            device_options["location_locks"] = StripedLocationLocks()
+            device_options["process_barrier"] = ProcessBarrier(num_shards)
+
+        for device_testdata in self.testcase.devices:
+            device_id = device_testdata.id
+            sensor_data = {loc : data for (loc, data) in device_testdata.locations}
+            if self.store is not None:
+                sensor_data = self.store.view(device_id, sensor_data)
+            supervisor = Runtime(self, device_id)
+            device = Device(device_id, sensor_data, supervisor, **device_options)
+            self.devices[device_id] = DeviceRunData(device=device, crt_timepoint=0)
+
+        for ((device_id, time_point), neighbour_ids) in self.neighbour_ids.items():
+            self.neighbours[(device_id, time_point)] = tuple(self.devices[neigh_id].device
+                                                             for neigh_id in neighbour_ids)
+
+        devices = [device_rd.device for device_rd in self.devices.values()]
+        if num_shards > 1:
+            self.__run_shards([devices[i::num_shards] for i in range(num_shards)])
+        else:
+            self.__run_devices(devices)
+
         self.validate(self.testcase.duration + self.testcase.extra_duration - 1)
 
         for msg in self.status():
@@ -354,15 +483,24 @@ class Runtime(object):
 
     def get_neighbours(self):
         """
-        Returns the list of neighbours for the current timepoint and increments the timepoint for
-        the next invocation.
+        Returns the neighbours for the current timepoint and increments the timepoint for
+        the next invocation. The device itself is not among them.
         WARNING: this method is not thread-safe, do not call it concurrently
 
-        @rtype: List of Device
-        @return: the list of current neighbours
+        @rtype: Tuple of Device
+        @return: the current neighbours, each given once
         """
         return self.supervisor.get_neighbours(self.device_id)
 
+    def report(self, message):
+        """
+        Reports an error raised while the device was running its scripts.
+
+        @type message: String
+        @param message: the error message to log
+        """
+        self.supervisor.report(message)
+
 
 class DeviceRunData:
     def __init__(self, device, crt_timepoint):
@@ -373,6 +511,325 @@ class DeviceRunData:
 ScriptRunData = namedtuple("ScriptRunData", ['script', 'location'])
 
 
+class ScriptDispatcher(object):
+    """
+    Small pool of long-lived tester threads which run functions once their due time comes.
+    Scripts are delivered through it instead of spawning sender threads at every timepoint.
+    The functions must not block, as they share the pool's threads.
+    """
+
+    def __init__(self, supervisor, num_threads, virtual_clock=None):
+        """
+        !!! This is not part of the assignment API, do not call it !!!
+
+        Creates and starts the dispatcher threads, registering them as banned threads.
+
+        @type supervisor: Supervisor
+        @param supervisor: the supervisor which bans the dispatcher threads
+        @type num_threads: Integer
+        @param num_threads: the number of threads in the pool
+        @type virtual_clock: VirtualClock
+        @param virtual_clock: if given, delays are waited on this clock instead of the
+            wall clock
+        """
+        self.virtual_clock = virtual_clock
+        self.queue = []
+        self.seq = 0
+        self.stopped = False
+        self.cond = Condition()
+        self.threads = []
+        for i in range(num_threads):
+            thread = Thread(name="Sender %d" % i, target=self.__run)
+            supervisor.register_banned_thread(thread)
+            self.threads.append(thread)
+            thread.start()
+
+    def call_later(self, delay, function, *args):
+        """
+        Schedules a function to run after the given delay.
+
+        @type delay: Float
+        @param delay: the delay in seconds
+        @type function: Callable
+        @param function: the function to call
+        """
+        if self.virtual_clock is not None and delay > 0:
+            # the clock hands the function back once it is due, to run on our threads
+            self.virtual_clock.call_later(delay, self.call_later, 0, function, *args)
+            return
+        with self.cond:
+            # seq keeps functions with the same due time in scheduling order
+            heapq.heappush(self.queue, (time.time() + delay, self.seq, function, args))
+            self.seq += 1
+            self.cond.notify()
+
+    def shutdown(self):
+        """
+        Stops the dispatcher threads; functions not yet due are dropped.
+        """
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def __run(self):
+        while True:
+            with self.cond:
+                while not self.stopped:
+                    if not self.queue:
+                        self.cond.wait()
+                        continue
+                    remaining = self.queue[0][0] - time.time()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                if self.stopped:
+                    return
+                (_, _, function, args) = heapq.heappop(self.queue)
+            function(*args)
+
+
+class ScriptDelivery(object):
+    """
+    Delivery of one timepoint's scripts to a device. Each group of scripts is sent after its
+    delay, its last script after a second delay, and the end of the timepoint is signaled
+    once all the groups were sent.
+    """
+
+    def __init__(self, device, groups):
+        """
+        !!! This is not part of the assignment API, do not call it !!!
+
+        @type device: device.Device
+        @param device: the receiving device
+        @type groups: List of (List of ScriptRunData)
+        @param groups: the scripts, grouped as they would be sent by one sender
+        """
+        self.device = device
+        self.groups = groups
+        self.pending = len(groups)
+        self.lock = Lock()
+        self.done = Event()
+        self.dispatcher = None
+
+    def start(self, dispatcher, delays):
+        """
+        Schedules the groups on the dispatcher.
+
+        @type dispatcher: ScriptDispatcher
+        @param dispatcher: the dispatcher running the delivery
+        @type delays: List of Float
+        @param delays: the delay of each group
+        """
+        self.dispatcher = dispatcher
+        for (group, delay) in zip(self.groups, delays):
+            dispatcher.call_later(delay, self.__send_group, group, delay)
+        if not self.groups:
+            dispatcher.call_later(0, self.__send_end)
+
+    def __send_group(self, group, delay):
+        for script_rd in group[:-1]:
+            self.device.assign_script(script_rd.script, script_rd.location)
+        if group:
+            self.dispatcher.call_later(delay, self.__send_last, group[-1])
+        else:
+            self.__group_sent()
+
+    def __send_last(self, script_rd):
+        self.device.assign_script(script_rd.script, script_rd.location)
+        self.__group_sent()
+
+    def __group_sent(self):
+        with self.lock:
+            self.pending -= 1
+            last = self.pending == 0
+        if last:
+            self.__send_end()
+
+    def __send_end(self):
+        self.device.assign_script(None, None)
+        self.done.set()
+
+
+class ReferenceModel(object):
+    """
+    Sequential reference computation of the sensor data, used for validation. It keeps its
+    state between calls and is advanced one timepoint at a time.
+    """
+
+    # pylint: disable=protected-access
+
+    def __init__(self, testcase, scripts, neighbour_ids):
+        """
+        !!! This is not part of the assignment API, do not call it !!!
+
+        @type testcase: testcase.TestCase
+        @param testcase: the test whose data is computed
+        @type scripts: Dict of Integer to (Dict of Integer to List of ScriptRunData)
+        @param scripts: the scripts assigned to each device at each timepoint
+        @type neighbour_ids: Dict of (Integer, Integer) to Tuple of Integer
+        @param neighbour_ids: the neighbours of each device at each timepoint, without
+            duplicates and without the device itself
+        """
+        self.scripts = scripts
+        self.neighbour_ids = neighbour_ids
+        self.data = {}
+        for device_testdata in testcase.devices:
+            self.data[device_testdata.id] = {loc : data for (loc, data) in device_testdata.locations}
+        # scripts assigned until now, in execution order, as (device_id, ScriptRunData)
+        self.assigned = []
+        # the last timepoint whose scripts were applied
+        self.time_point = -1
+
+    def advance(self, time_point):
+        """
+        Applies the scripts of all the timepoints up to and including time_point.
+
+        @type time_point: Integer
+        @param time_point: the timepoint after which the data is needed
+        """
+        while self.time_point < time_point:
+            self.time_point += 1
+            tpt = self.time_point
+
+            for (dev, scripts) in self.scripts[tpt].items():
+                for script_rd in scripts:
+                    self.assigned.append((dev, script_rd))
+
+            data = self.data
+            for (dev, script_rd) in self.assigned:
+                location = script_rd.location
+                neighbour_ids = self.neighbour_ids.get((dev, tpt), ())
+
+                script_data = []
+                # collect data from current neighbours
+                for neigh in neighbour_ids:
+                    if location in data[neigh]:
+                        script_data.append(data[neigh][location])
+                # add our data, if any
+                if location in data[dev]:
+                    script_data.append(data[dev][location])
+
+                # run script on data
+                if script_data != []:
+                    result = script_rd.script._Script__update(script_data)
+
+                    # update data of neighbours
+                    for neigh in neighbour_ids:
+                        if location in data[neigh]:
+                            data[neigh][location] = result
+                    # update our data
+                    if location in data[dev]:
+                        data[dev][location] = result
+
+    def values(self):
+        """
+        Iterates over the reference data.
+
+        @rtype: Iterator of (Integer, Integer, Float)
+        @return: (device id, location, data) for every location known by a device
+        """
+        for (dev_id, sens_data) in self.data.items():
+            for (loc, ref_data) in sens_data.items():
+                yield (dev_id, loc, ref_data)
+
+
+class NumpyReferenceModel(object):
+    """
+    Reference computation backed by a dense devices x locations array and a presence mask.
+    The scripts of a timepoint are split in rounds holding at most one script per location;
+    the scripts of a round touch disjoint cells, so each round is a single masked
+    gather / max / scatter. Results are identical to ReferenceModel.
+    """
+
+    # pylint: disable=protected-access
+
+    def __init__(self, testcase, scripts, neighbour_ids):
+        """
+        !!! This is not part of the assignment API, do not call it !!!
+
+        The parameters are the same as for ReferenceModel.
+        """
+        self.scripts = scripts
+        self.neighbour_ids = neighbour_ids
+        num_devices = len(testcase.devices)
+        self.data = numpy.zeros((num_devices, testcase.num_locations))
+        self.mask = numpy.zeros((num_devices, testcase.num_locations), dtype=bool)
+        for device_testdata in testcase.devices:
+            for (loc, data) in device_testdata.locations:
+                self.data[device_testdata.id, loc] = data
+                self.mask[device_testdata.id, loc] = True
+        self.assigned = []
+        self.time_point = -1
+
+    def advance(self, time_point):
+        """
+        Applies the scripts of all the timepoints up to and including time_point.
+
+        @type time_point: Integer
+        @param time_point: the timepoint after which the data is needed
+        """
+        while self.time_point < time_point:
+            self.time_point += 1
+            tpt = self.time_point
+
+            for (dev, scripts) in self.scripts[tpt].items():
+                for script_rd in scripts:
+                    self.assigned.append((dev, script_rd))
+
+            for script_round in self.__split_rounds():
+                self.__run_round(tpt, script_round)
+
+    def __split_rounds(self):
+        # the k-th script of every location goes to round k, which keeps the
+        # order of the scripts sharing a location
+        rounds = []
+        seen = {}
+        for (dev, script_rd) in self.assigned:
+            k = seen.get(script_rd.location, 0)
+            seen[script_rd.location] = k + 1
+            if k == len(rounds):
+                rounds.append([])
+            rounds[k].append((dev, script_rd))
+        return rounds
+
+    def __run_round(self, tpt, script_round):
+        rows = []
+        starts = []
+        for (dev, _) in script_round:
+            starts.append(len(rows))
+            rows.extend(self.neighbour_ids.get((dev, tpt), ()))
+            rows.append(dev)
+        lengths = numpy.diff(starts + [len(rows)])
+        rows = numpy.array(rows)
+        cols = numpy.repeat([script_rd.location for (_, script_rd) in script_round], lengths)
+        thresholds = numpy.array([script_rd.script._Script__threshold
+                                  for (_, script_rd) in script_round], dtype=float)
+
+        # gather
+        present = self.mask[rows, cols]
+        values = numpy.where(present, self.data[rows, cols], -numpy.inf)
+        has_data = numpy.logical_or.reduceat(present, starts)
+        results = numpy.maximum(numpy.maximum.reduceat(values, starts), thresholds)
+
+        # scatter to the devices that have the location
+        script_ids = numpy.repeat(numpy.arange(len(script_round)), lengths)
+        update = present & has_data[script_ids]
+        self.data[rows[update], cols[update]] = results[script_ids[update]]
+
+    def values(self):
+        """
+        Iterates over the reference data.
+
+        @rtype: Iterator of (Integer, Integer, Float)
+        @return: (device id, location, data) for every location known by a device
+        """
+        (dev_ids, locs) = numpy.nonzero(self.mask)
+        for (dev_id, loc) in zip(dev_ids.tolist(), locs.tolist()):
+            yield (dev_id, loc, self.data[dev_id, loc])
+
+
 class Script(object):
     """
     Encapsulates the algoritm for improving noisy measurement data.
@@ -401,14 +858,57 @@ class Script(object):
         self.__supervisor.check_execution("run", self.__device)
 
         if self.__delay is not None:
-            sleep(uniform(self.__delay[0], self.__delay[1]))
+            self.__supervisor.clock.sleep(uniform(self.__delay[0], self.__delay[1]))
 
         return self.__update(data)
 
+    def run_batch(self, data_lists, scripts=None):
+        """
+        Executes scripts of this script's device on several independent data lists, e.g. for
+        several locations. The calling thread is checked and the delay of this script is paid
+        once for the whole batch.
+
+        @type data_lists: List of (List of Integer)
+        @param data_lists: the data of each run, none of them empty
+
+        @type scripts: List of Script
+        @param scripts: the script run on each data list, all assigned to the same device as
+            this one; by default this script runs on every list
+
+        @rtype: List of Integer
+        @return: improved measurement for each data list
+        """
+        self.__supervisor.check_execution("run", self.__device)
+
+        if scripts is None:
+            thresholds = [self.__threshold] * len(data_lists)
+        else:
+            for script in scripts:
+                if script.__device is not self.__device:
+                    self.__supervisor.report("device '%s' is batching a script of device '%s'"
+                                             % (str(self.__device), str(script.__device)))
+            thresholds = [script.__threshold for script in scripts]
+
+        if self.__delay is not None:
+            self.__supervisor.clock.sleep(uniform(self.__delay[0], self.__delay[1]))
+
+        return Script.__update_batch(data_lists, thresholds)
+
     def __update(self, sensor_data):
         # sa nu uit sa implementez algoritmul ;)
         return max(self.__threshold, max(sensor_data))
 
+    @staticmethod
+    def __update_batch(data_lists, thresholds):
+        # the same algorithm as __update, for each list with its script's threshold
+        if numpy is None or len(data_lists) < NUMPY_BATCH_MIN:
+            return [max(threshold, max(sensor_data))
+                    for (sensor_data, threshold) in zip(data_lists, thresholds)]
+        lengths = [len(sensor_data) for sensor_data in data_lists]
+        starts = numpy.cumsum([0] + lengths[:-1])
+        values = numpy.fromiter(chain.from_iterable(data_lists), float, sum(lengths))
+        return numpy.maximum(numpy.maximum.reduceat(values, starts), thresholds).tolist()
+
     def __set_supervisor(self, supervisor):
         self.__supervisor = supervisor
 
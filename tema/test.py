@@ -6,10 +6,24 @@ Assignment 1
 March 2018
 """
 
+import errno
+import hashlib
 import os
+import pickle
+import random
 import re
+import struct
+import time
+from array import array
 from collections import namedtuple
 
+import tracelog
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # TestCase parameters, the same string as in the test* file format
 TESTCASE_NAME = "name"
 NUM_DEVICES = "num_nodes"
@@ -29,6 +43,19 @@ SCRIPT_ASSIGNMENT_RANDOM = "RANDOM"
 SCRIPT_ASSIGNMENT_ALL = "ALL"
 SCRIPT_ASSIGNMENT_SINGLE = "SINGLE"
 
+# Packed test case files: magic, format version and the length of the pickled scalar fields
+PACKED_MAGIC = "ASCT"
+PACKED_VERSION = 1
+PACKED_HEADER = struct.Struct("=4sIQ")
+PACKED_ARRAY_HEADER = struct.Struct("=cQ")
+
+# Version of the test data generation; bump it whenever generate_test_data creates different
+# tests from the same parameters and seed, so cached tests are not reused
+GENERATOR_VERSION = 1
+
+# Seconds after which a temporary cache file is considered left behind by a crashed tester
+STALE_TMP_AGE = 3600
+
 Location = namedtuple("Location", ['id', 'sensor_data'])
 Encounter = namedtuple("Encounter", ['time_point', 'devices'])
 DeviceTestData = namedtuple("DeviceTestData", ['id', 'locations', 'encounters'])
@@ -53,6 +80,7 @@ class TestCase(object):
         self.timeout = None
         self.num_iterations = None
         self.crt_iteration = None
+        self.options = RunOptions()
 
     @staticmethod
     def create_simple_test_case():
@@ -158,6 +186,104 @@ class TestCase(object):
 
         return test_case
 
+    def save(self, filename):
+        """
+        Writes the test case to a packed file. Devices, locations, encounters and scripts are
+        stored as flat typed arrays, with offset arrays marking where each device's locations
+        and encounters, and each encounter's devices, begin; the other fields are pickled.
+
+        @type filename: String
+        @param filename: the file to write
+        """
+        dev_ids = array('i')
+        loc_offsets = array('l', [0])
+        loc_ids = array('i')
+        loc_data = array('d')
+        enc_offsets = array('l', [0])
+        enc_time_points = array('i')
+        enc_dev_offsets = array('l', [0])
+        enc_devices = array('i')
+        for device in self.devices:
+            dev_ids.append(device.id)
+            for loc in device.locations:
+                loc_ids.append(loc.id)
+                loc_data.append(loc.sensor_data)
+            loc_offsets.append(len(loc_ids))
+            for enc in device.encounters:
+                enc_time_points.append(enc.time_point)
+                enc_devices.extend(enc.devices)
+                enc_dev_offsets.append(len(enc_devices))
+            enc_offsets.append(len(enc_time_points))
+
+        script_time_points = array('i', [script.time_point for script in self.scripts])
+        script_devices = array('i', [script.device for script in self.scripts])
+        script_locations = array('i', [script.location for script in self.scripts])
+
+        fields = {name : value for (name, value) in self.__dict__.items()
+                  if name not in ("devices", "scripts")}
+        fields = pickle.dumps(fields, pickle.HIGHEST_PROTOCOL)
+
+        with open(filename, "wb") as out_file:
+            out_file.write(PACKED_HEADER.pack(PACKED_MAGIC, PACKED_VERSION, len(fields)))
+            out_file.write(fields)
+            for arr in (dev_ids, loc_offsets, loc_ids, loc_data, enc_offsets, enc_time_points,
+                        enc_dev_offsets, enc_devices, script_time_points, script_devices,
+                        script_locations):
+                out_file.write(PACKED_ARRAY_HEADER.pack(arr.typecode, len(arr)))
+                arr.tofile(out_file)
+
+    @staticmethod
+    def load(filename):
+        """
+        Reads a test case written by save. The file is read in one piece and the arrays are
+        copied out of it without further parsing; the test's namedtuples are then rebuilt from
+        the arrays, so each process loading the test has its own copy.
+
+        @type filename: String
+        @param filename: the file to read
+        @rtype: TestCase
+        @return: a TestCase object
+        """
+        with open(filename, "rb") as in_file:
+            data = in_file.read()
+
+        (magic, version, fields_len) = PACKED_HEADER.unpack_from(data, 0)
+        if magic != PACKED_MAGIC or version != PACKED_VERSION:
+            raise StandardError("Wrong packed test file: %s" % filename)
+        pos = PACKED_HEADER.size
+        fields = pickle.loads(data[pos:pos + fields_len])
+        pos += fields_len
+
+        arrays = []
+        while pos < len(data):
+            (typecode, length) = PACKED_ARRAY_HEADER.unpack_from(data, pos)
+            pos += PACKED_ARRAY_HEADER.size
+            arr = array(typecode)
+            arr.fromstring(buffer(data, pos, length * arr.itemsize))
+            pos += length * arr.itemsize
+            arrays.append(arr)
+
+        (dev_ids, loc_offsets, loc_ids, loc_data, enc_offsets, enc_time_points,
+         enc_dev_offsets, enc_devices, script_time_points, script_devices,
+         script_locations) = arrays
+
+        test_case = TestCase()
+        test_case.__dict__.update(fields)
+
+        test_case.devices = []
+        for (i, dev_id) in enumerate(dev_ids):
+            locations = [Location(loc_ids[j], loc_data[j])
+                         for j in xrange(loc_offsets[i], loc_offsets[i + 1])]
+            encounters = [Encounter(enc_time_points[j],
+                                    enc_devices[enc_dev_offsets[j]:enc_dev_offsets[j + 1]].tolist())
+                          for j in xrange(enc_offsets[i], enc_offsets[i + 1])]
+            test_case.devices.append(DeviceTestData(dev_id, locations, encounters))
+
+        test_case.scripts = [ScriptTestData(*script) for script in
+                             zip(script_time_points, script_devices, script_locations)]
+
+        return test_case
+
     def generate_test_data(self, params, rand_gen):
         """
         Creates the elements of a test case: lists of devices, locations, encounters, scripts
@@ -192,16 +318,19 @@ class TestCase(object):
         else:
             self.devices = [DeviceTestData(i, [], []) for i in range(params.num_devices)]
 
-            # assign visited locations to devices
+            # assign visited locations to devices; the inverted index holds the
+            # locations of each device in increasing order
 
+            locations_for_devices = [[] for _ in range(params.num_devices)]
             for i in range(self.num_locations):
                 num_devices = rand_gen.randint(1, params.overlap)
                 devices_for_locations[i] = rand_gen.sample(xrange(params.num_devices), num_devices)
+                for device_id in devices_for_locations[i]:
+                    locations_for_devices[device_id].append(i)
 
             for device in self.devices:
-                for i in range(len(devices_for_locations)):
-                    if device.id in devices_for_locations[i]:
-                        device.locations.append(Location(i, rand_gen.randint(30, 100)))
+                for i in locations_for_devices[device.id]:
+                    device.locations.append(Location(i, rand_gen.randint(30, 100)))
 
         """ Create Scripts """
 
@@ -232,14 +361,16 @@ class TestCase(object):
 
         """ Create encounters """
 
+        devices_by_id = {d.id : d for d in self.devices}
+
         for script in self.scripts:
             loc = script.location
-            time = script.time_point
+            time_point = script.time_point
             device = script.device
 
             location_devices = devices_for_locations[loc]
             encounters = []
-            num_encouters = rand_gen.randint(1, self.duration+self.extra_duration-time)
+            num_encouters = rand_gen.randint(1, self.duration+self.extra_duration-time_point)
 
             set_of_unique_devices = set()
             for i in range(num_encouters):
@@ -248,16 +379,13 @@ class TestCase(object):
                                                     rand_gen.randint(1, len(location_devices)/2+1))
                 set_of_unique_devices |= set(encountered_devices)
 
-                encounters.append(Encounter(time+i, encountered_devices))
+                encounters.append(Encounter(time_point+i, encountered_devices))
 
             for dev in location_devices:
                 if dev not in set_of_unique_devices:
                     encounters[rand_gen.randint(0, len(encounters)-1)].devices.append(dev)
 
-            for d in self.devices:
-                if d.id == device:
-                    d.encounters.extend(encounters)
-                    break
+            devices_by_id[device].encounters.extend(encounters)
 
         # print "Locations: ",
         # for loc in range(len(devices_for_locations)):
@@ -281,6 +409,222 @@ class TestCase(object):
 
 
 
+class TestCaseCache(object):
+    """
+    On-disk cache of generated test cases, stored in the packed format. Entries are keyed by
+    a hash of the test parameters, of the generator's version and of the random generator's
+    state; the least recently used ones are evicted when the cache grows over its size limit.
+    """
+
+    def __init__(self, directory, max_size):
+        """
+        @type directory: String
+        @param directory: the directory holding the cached tests, created if missing
+        @type max_size: Integer
+        @param max_size: the maximum size of the cache, in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def key(params, rand_gen):
+        """
+        Computes the cache key of a test case.
+
+        @type params: TestParams
+        @param params: the test case specification
+        @type rand_gen: Random
+        @param rand_gen: the random generator the test would be created with
+        @rtype: String
+        @return: the key
+        """
+        digest = hashlib.sha1()
+        digest.update("%d %d %r" % (PACKED_VERSION, GENERATOR_VERSION,
+                                    sorted(params.__dict__.items())))
+        # a test with its own seed does not use the given generator
+        if params.gen_seed is None:
+            digest.update(repr(rand_gen.getstate()))
+        return digest.hexdigest()
+
+    def create_test_case(self, params, rand_gen):
+        """
+        Returns the cached test case for the parameters, creating and caching it on a miss.
+        The parameters are the same as for TestCase.create_test_case.
+
+        @rtype: TestCase
+        @return: a TestCase object
+        """
+        filename = os.path.join(self.directory, TestCaseCache.key(params, rand_gen) + ".asct")
+        if os.path.exists(filename):
+            try:
+                test_case = TestCase.load(filename)
+                os.utime(filename, None)
+                # the entry may predate some options; they are set for each run anyway
+                test_case.options = RunOptions()
+                return test_case
+            except (StandardError, EnvironmentError):
+                pass
+
+        test_case = TestCase.create_test_case(params, rand_gen)
+
+        # write to a temporary name first, so concurrent testers never see a partial file
+        tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+        test_case.save(tmp_filename)
+        os.rename(tmp_filename, filename)
+        self.evict()
+
+        return test_case
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache fits its size limit, and the
+        temporary files left behind by testers which crashed while writing an entry. Other
+        testers may be evicting at the same time, so files can vanish at any point.
+        """
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".asct") and not name.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+                continue
+            if name.endswith(".tmp") and now - stat.st_mtime > STALE_TMP_AGE:
+                TestCaseCache.remove(os.path.join(self.directory, name))
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+
+        # files being written count towards the size, but only finished entries are evicted
+        total_size = sum(size for (_, size, _) in entries)
+        for (_, size, name) in entries:
+            if total_size <= self.max_size:
+                break
+            if name.endswith(".asct"):
+                TestCaseCache.remove(os.path.join(self.directory, name))
+                total_size -= size
+
+    @staticmethod
+    def remove(filename):
+        """
+        Deletes a cache file, unless another tester already did.
+
+        @type filename: String
+        @param filename: the file to delete
+        """
+        try:
+            os.remove(filename)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+
+class RunOptions(object):
+    """
+    Class representing options that change how a test case is run, not what it contains.
+    """
+
+    # values accepted by the boolean options
+    TRUE = ("1", "true", "yes")
+    FALSE = ("0", "false", "no")
+
+    # values accepted by the options which are not free-form
+    CHOICES = {
+        "reference_engine" : ("dict", "numpy"),
+        "sensor_storage" : ("dict", "array", "store"),
+        "log_level" : tuple(sorted(tracelog.LEVELS, key=tracelog.LEVELS.get)),
+    }
+
+    def __init__(self):
+        # also check the data after every timepoint; intermediate states only match when the
+        # scripts of a timepoint give the same result in any order, so their differences are
+        # printed as warnings and only the check at the end fails the test
+        self.validate_each_timepoint = False
+        # reference computation used for validation: "dict" or "numpy"
+        self.reference_engine = "dict"
+        # threads used by the supervisor to deliver scripts
+        self.sender_threads = 4
+        # worker threads each device runs its scripts on
+        self.num_workers = 8
+        # storage for the devices' sensor data: "dict", "array" or "store", a central array of
+        # all the devices' data
+        self.sensor_storage = "dict"
+        # file the central store is memory-mapped to, a %d in the name is replaced by the
+        # iteration; by default the store is in anonymous memory
+        self.store_file = ""
+        # share the results of identical script runs within a timepoint
+        self.memoize_scripts = False
+        # file receiving the time devices spend in each phase of a timepoint, .json or .csv;
+        # a %d in the name is replaced by the iteration
+        self.timings_file = ""
+        # device trace messages kept and printed at the end: "off", "info" or "debug"
+        self.log_level = "off"
+        # simulate the script and delivery delays on a virtual clock instead of sleeping,
+        # and print the simulated time taken by each timepoint
+        self.virtual_time = False
+        # real time, in seconds, without new events after which the virtual clock advances;
+        # raise it on a loaded machine, where a slow thread can be overtaken by the clock
+        self.virtual_grace = 0.002
+        # number of processes the devices are split over, sharing their data in shared
+        # memory; 0 or 1 runs all the devices as threads of one process. Each process
+        # would need its own virtual clock, so sharding excludes virtual_time
+        self.shards = 0
+
+    def set(self, name, value):
+        """
+        Sets an option given as a string, converting it to the type of the option's default.
+
+        @type name: String
+        @param name: the option name
+        @type value: String
+        @param value: the option value
+        """
+        if name not in self.__dict__:
+            raise StandardError("Wrong option name: %s" % name)
+
+        default = getattr(self, name)
+        if isinstance(default, bool):
+            accepted = RunOptions.TRUE + RunOptions.FALSE
+            if value.lower() not in accepted:
+                raise StandardError("Wrong value for option %s: %s, expected one of %s"
+                                    % (name, value, ", ".join(accepted)))
+            value = value.lower() in RunOptions.TRUE
+        elif isinstance(default, int):
+            value = int(value)
+        elif isinstance(default, float):
+            value = float(value)
+        if name in RunOptions.CHOICES and value not in RunOptions.CHOICES[name]:
+            raise StandardError("Wrong value for option %s: %s, expected one of %s"
+                                % (name, value, ", ".join(RunOptions.CHOICES[name])))
+        setattr(self, name, value)
+
+    def check(self):
+        """
+        Checks that the options can be used together. Called by the tester before any test
+        runs, as an error raised in a running test only shows as a timeout.
+        """
+        if self.reference_engine == "numpy" and numpy is None:
+            raise StandardError("The numpy reference engine needs numpy installed")
+        if self.virtual_grace <= 0:
+            raise StandardError("virtual_grace must be positive")
+        if self.sender_threads < 1:
+            raise StandardError("sender_threads must be at least 1")
+        if self.num_workers < 1:
+            raise StandardError("num_workers must be at least 1")
+        if self.shards > 1 and (self.validate_each_timepoint or self.timings_file
+                                or self.virtual_time):
+            raise StandardError("Sharded runs support neither validate_each_timepoint, "
+                                "timings_file nor virtual_time")
+
+    def __str__(self):
+        return ", ".join("%s=%s" % item for item in sorted(self.__dict__.items()))
+
+
 class TestParams(object):
     """
     Class representing the parameters of a test case, as specified in test input files.
@@ -432,5 +776,4 @@ class TestParams(object):
 if __name__ == "__main__":
     params = TestParams.load_test("../tests/test1")
     print params
-    import random
     TestCase.create_test_case(params, random.Random())
@@ -13,10 +13,13 @@ import pickle
 import random
 import subprocess
 import sys
+import tempfile
+import time
 from threading import Timer
+from traceback import print_exc
 
 from supervisor import Supervisor
-from test import TestCase, TestParams
+from test import TestCase, TestCaseCache, TestParams
 
 # Tester messages
 START_TEST_MSG       = "**************** Start %10s *****************"      # pylint: disable=bad-whitespace
@@ -25,17 +28,33 @@ TEST_ERRORS_MSG      = "Errors in iteration %d of %d:"                      # py
 TEST_FINISHED_MSG    = "%-10s finished.................%d%% completed"      # pylint: disable=bad-whitespace
 TIMEOUT_MSG          = "%-10s timeout..................%d%% completed"      # pylint: disable=bad-whitespace
 
+# Ways of running an iteration in its own process
+MODE_SUBPROCESS = "subprocess"
+MODE_FORK = "fork"
+MODE_PACKED = "packed"
+
+# Seconds between checks of the running iterations when running in parallel
+POLL_INTERVAL = 0.01
+
 class Tester(object):
     """
     Runs the test.
     """
-    def __init__(self, output_filename):
+    def __init__(self, output_filename, mode=MODE_SUBPROCESS):
         """
         Constructor.
         @type output_filename: String
         @param output_filename: the file in which the tester logs results
+        @type mode: String
+        @param mode: how iterations are isolated: MODE_SUBPROCESS starts a new interpreter
+        and pipes it the pickled test, MODE_PACKED starts a new interpreter which maps the
+        test from a packed file written once per test, MODE_FORK forks this already
+        initialized process
         """
         self.output_filename = output_filename
+        self.mode = mode
+        # packed file of each test, by id of the TestCase object
+        self.packed_files = {}
 
         self.passed_tests = 0
 
@@ -66,9 +85,74 @@ class Tester(object):
 
         print END_TEST_MSG % testcase.name
 
+        self.remove_packed_files()
+        self.write_result(testcase, self.passed_tests, num_iterations)
+
+    def run_tests(self, testcases, num_iterations=1, jobs=1):
+        """
+        Performs several testcases, running up to 'jobs' iterations at the same
+        time in separate processes. The results are written in the order of the
+        testcases, regardless of the order in which the iterations finish.
+        @type testcases: List of TestCase
+        @param testcases: the testcases to run
+        @type num_iterations: Integer
+        @param num_iterations: number of time to run each test
+        @type jobs: Integer
+        @param jobs: maximum number of iterations running concurrently
+        """
+        if jobs <= 1:
+            for testcase in testcases:
+                self.run_test(testcase, num_iterations)
+            return
+
+        for testcase in testcases:
+            print START_TEST_MSG % testcase.name
+            testcase.num_iterations = num_iterations
+
+        passed = [0] * len(testcases)
+        pending = [(i, it) for i in range(len(testcases)) for it in range(num_iterations)]
+        pending.reverse()
+        running = []
+
+        while pending or running:
+            while pending and len(running) < jobs:
+                (i, iteration) = pending.pop()
+                testcases[i].crt_iteration = iteration + 1
+                print "%s: " % testcases[i].name + TEST_ERRORS_MSG % (iteration + 1, num_iterations)
+                running.append((i, iteration, self.launch_test(testcases[i])))
+
+            still_running = []
+            for (i, iteration, child) in running:
+                return_code = child.poll()
+                if return_code is None:
+                    still_running.append((i, iteration, child))
+                elif return_code == 0:
+                    passed[i] += 1
+                    print "%s: iteration %d: No errors" % (testcases[i].name, iteration + 1)
+            if len(still_running) == len(running):
+                time.sleep(POLL_INTERVAL)
+            running = still_running
+
+        self.remove_packed_files()
+        for (i, testcase) in enumerate(testcases):
+            print END_TEST_MSG % testcase.name
+            self.write_result(testcase, passed[i], num_iterations)
+
+    def remove_packed_files(self):
+        """
+        Deletes the packed test files written for MODE_PACKED.
+        """
+        for filename in self.packed_files.values():
+            os.remove(filename)
+        self.packed_files = {}
+
+    def write_result(self, testcase, passed_tests, num_iterations):
+        """
+        Appends the pass rate of a testcase to the output file.
+        """
         out_file = open(self.output_filename, "a")
 
-        msg = TEST_FINISHED_MSG % (testcase.name, 100.0 * self.passed_tests / num_iterations)
+        msg = TEST_FINISHED_MSG % (testcase.name, 100.0 * passed_tests / num_iterations)
 
         out_file.write(msg + "\n")
         out_file.close()
@@ -86,38 +170,189 @@ class Tester(object):
 
         os.abort()
 
+    @staticmethod
+    def virtual_timer_fn(timeout):
+        """
+        Timer function, it's executed when the simulated time of a virtual-time run passes
+        the test's timeout. The clock may run ahead of slow threads on a loaded machine, so
+        this is only a warning; deadlocks are caught by the wall clock watchdog.
+
+        @type timeout: Float
+        @param timeout: the timeout of the test case, in seconds
+        """
+        print >> sys.stderr, "warning: simulated time passed the timeout of %s s" % timeout
+
     def start_test(self, test):
         """
-        Starts a child process that will run the test case.
+        Starts a child process that will run the test case and waits for it.
 
         @type test: TestCase
         @param test: an object containing all the information necessary for
         running the test case
+
+        @rtype: Integer
+        @return: the child's return code, negative if it was killed by a signal
+        """
+        return self.launch_test(test).wait()
+
+    def launch_test(self, test):
         """
+        Starts a child process that will run the test case, without waiting for it.
+
+        @type test: TestCase
+        @param test: an object containing all the information necessary for
+        running the test case
+
+        @rtype: subprocess.Popen or ForkedTest
+        @return: the child process, with poll() and wait() methods returning its return code
+        """
+        if self.mode == MODE_FORK:
+            return ForkedTest(test)
+
         path = os.path.dirname(sys.argv[0])
         path = "." if path == "" else path
+
+        if self.mode == MODE_PACKED:
+            if id(test) not in self.packed_files:
+                (handle, filename) = tempfile.mkstemp(suffix=".asct")
+                os.close(handle)
+                test.save(filename)
+                self.packed_files[id(test)] = filename
+            command = "python %s/tester.py -l %s -n %d" % (path, self.packed_files[id(test)],
+                                                          test.crt_iteration)
+            return subprocess.Popen(command, shell=True)
+
         command = "python %s/tester.py" % path
         test = pickle.dumps(test)
         process = subprocess.Popen(command, stdin=subprocess.PIPE, shell=True)
-        process.communicate(test)
+        process.stdin.write(test)
+        process.stdin.close()
+
+        return process
+
+
+class ForkedTest(object):
+    """
+    Runs a test case in a forked copy of this process. The child already has
+    everything imported and the test in memory, and a crash or os.abort() in it
+    does not affect the tester.
+    """
 
-        return process.returncode
+    def __init__(self, test):
+        """
+        Forks the child process.
+
+        @type test: TestCase
+        @param test: the test case to run
+        """
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        self.returncode = None
+        self.pid = os.fork()
+        if self.pid == 0:
+            # like a new interpreter, each iteration draws its own delays and orders
+            random.seed()
+            return_code = 1
+            try:
+                return_code = run_child(test)
+            except Exception:   # pylint: disable=broad-except
+                print_exc()
+            finally:
+                os._exit(return_code)   # pylint: disable=protected-access
+
+    def poll(self):
+        """
+        Checks whether the child terminated.
+
+        @rtype: Integer
+        @return: the child's return code, negative if it was killed by a signal;
+        None if it is still running
+        """
+        return self.__wait(os.WNOHANG)
+
+    def wait(self):
+        """
+        Waits for the child to terminate.
+
+        @rtype: Integer
+        @return: the child's return code, negative if it was killed by a signal
+        """
+        return self.__wait(0)
+
+    def __wait(self, flags):
+        if self.returncode is None:
+            (pid, status) = os.waitpid(self.pid, flags)
+            if pid != 0:
+                if os.WIFSIGNALED(status):
+                    self.returncode = -os.WTERMSIG(status)
+                else:
+                    self.returncode = os.WEXITSTATUS(status)
+        return self.returncode
+
+
+def run_child(test):
+    """
+    Runs one iteration of a test case under a watchdog. This is the body of
+    the child process.
+
+    @type test: TestCase
+    @param test: the test case to run
+
+    @rtype: Integer
+    @return: the number of errors
+    """
+    watchdog = Timer(interval=test.timeout,
+                     function=Tester.timer_fn,
+                     args=(test.crt_iteration, test.num_iterations))
+
+    watchdog.start()
+
+    supervisor = Supervisor(test)
+    supervisor.register_banned_thread(watchdog)
+    supervisor.register_banned_thread()
+
+    # the simulated time passing the timeout is only reported, as the virtual clock can
+    # overtake slow threads; the wall clock watchdog still catches deadlocks
+    virtual_watchdog = None
+    if test.options.virtual_time:
+        virtual_watchdog = supervisor.clock.timer(test.timeout, Tester.virtual_timer_fn,
+                                                  test.timeout)
+
+    return_code = supervisor.run_testcase()
+
+    watchdog.cancel()
+    if virtual_watchdog is not None:
+        supervisor.clock.cancel(virtual_watchdog)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return return_code
 
 
 def usage(argv):
     print "Usage: python %s [OPTIONS]"%argv[0]
     print "options:"
     print "\t-t,   --test\tspecial test to run"
-    print "\t-f,   --testfile\ttest file, if not specified run a pickled test from stdin"
+    print "\t-f,   --testfile\ttest file, if not specified run a pickled test from stdin; may be repeated"
     print "\t-o,   --out\t\toutput file"
     print "\t-i,   --iterations\t\tthe number of times the test is run (iterations), defaults to 2"
+    print "\t-j,   --jobs\t\tthe number of iterations run in parallel, defaults to 1"
+    print "\t-m,   --mode\t\thow iterations are run: subprocess (default), packed or fork"
+    print "\t-l,   --load\t\tchild process: run the test from a packed file"
+    print "\t-n,   --iteration\tchild process: the iteration run from the packed file"
+    print "\t-c,   --cache\t\tdirectory where generated tests are cached"
+    print "\t-s,   --cache-size\tmaximum size of the test cache in MB, defaults to 512"
+    print "\t-O,   --option\t\trun option as name=value, may be repeated"
     print "\t-h,   --help\t\tprint this help screen"
 
 
 def main():
     try:
-        opts, _ = getopt.getopt(sys.argv[1:], "h:t:f:o:i:",
-                                ["help", "--test", "testfile=", "out=", "iterations="])
+        opts, _ = getopt.getopt(sys.argv[1:], "h:t:f:o:i:j:m:l:n:c:s:O:",
+                                ["help", "--test", "testfile=", "out=", "iterations=", "jobs=",
+                                 "mode=", "load=", "iteration=", "cache=", "cache-size=",
+                                 "option="])
 
     except getopt.GetoptError, err:
         print str(err)
@@ -125,9 +360,16 @@ def main():
         sys.exit(2)
 
     test_name = None
-    test_file = ""
+    test_files = []
     iterations = 2
+    jobs = 1
+    packed_file = None
+    crt_iteration = 1
+    cache_dir = None
+    cache_size = 512
     output_file = "tester.out"
+    mode = MODE_SUBPROCESS
+    options = []
 
     for opt, arg in opts:
         if opt in ("-h", "--help"):
@@ -136,7 +378,7 @@ def main():
         elif opt in ("-t", "--test"):
             test_name = arg
         elif opt in ("-f", "--testfile"):
-            test_file = arg
+            test_files.append(arg)
         elif opt in ("-o", "--out"):
             output_file = arg
         elif opt in ("-i", "--iterations"):
@@ -145,46 +387,80 @@ def main():
             except TypeError, err:
                 print str(err)
                 sys.exit(2)
+        elif opt in ("-j", "--jobs"):
+            try:
+                jobs = int(arg)
+            except ValueError, err:
+                print str(err)
+                sys.exit(2)
+        elif opt in ("-m", "--mode"):
+            if arg not in (MODE_SUBPROCESS, MODE_PACKED, MODE_FORK):
+                print "Wrong mode: %s" % arg
+                sys.exit(2)
+            mode = arg
+        elif opt in ("-l", "--load"):
+            packed_file = arg
+        elif opt in ("-n", "--iteration"):
+            try:
+                crt_iteration = int(arg)
+            except ValueError, err:
+                print str(err)
+                sys.exit(2)
+        elif opt in ("-c", "--cache"):
+            cache_dir = arg
+        elif opt in ("-s", "--cache-size"):
+            try:
+                cache_size = int(arg)
+            except ValueError, err:
+                print str(err)
+                sys.exit(2)
+        elif opt in ("-O", "--option"):
+            if "=" not in arg:
+                print "Wrong option format: %s" % arg
+                sys.exit(2)
+            options.append([part.strip() for part in arg.split("=", 1)])
         else:
             assert False, "unhandled option"
 
+    tester = Tester(output_file, mode)
+    tests = []
     if test_name == "test0":
-        tester = Tester(output_file)
-        test = TestCase.create_simple_test_case()
-        tester.run_test(test, iterations)
+        tests.append(TestCase.create_simple_test_case())
     elif test_name == "test9":
-        tester = Tester(output_file)
-        test = TestCase.create_sharing1_test_case()
-        tester.run_test(test, iterations)
+        tests.append(TestCase.create_sharing1_test_case())
     elif test_name == "test10":
-        tester = Tester(output_file)
-        test = TestCase.create_sharing2_test_case()
-        tester.run_test(test, iterations)
-    elif test_file:
-        tester = Tester(output_file)
+        tests.append(TestCase.create_sharing2_test_case())
+    cache = None
+    if cache_dir is not None and test_files:
+        cache = TestCaseCache(cache_dir, cache_size * 1024 * 1024)
+    for test_file in test_files:
+        # every file is generated as if it was the only one
+        tester.rand_gen.seed(0)
         test_params = TestParams.load_test(test_file)
-        test = TestCase.create_test_case(test_params, tester.rand_gen)
-        tester.run_test(test, iterations)
+        if cache is not None:
+            tests.append(cache.create_test_case(test_params, tester.rand_gen))
+        else:
+            tests.append(TestCase.create_test_case(test_params, tester.rand_gen))
+
+    if tests:
+        try:
+            for test in tests:
+                for (name, value) in options:
+                    test.options.set(name, value)
+                test.options.check()
+        except StandardError, err:
+            print str(err)
+            sys.exit(2)
+        tester.run_tests(tests, iterations, jobs)
+
+    elif packed_file:  # I'm the child process, with a packed test
+        test = TestCase.load(packed_file)
+        test.crt_iteration = crt_iteration
+        sys.exit(run_child(test))
 
     else:  # I'm the child process :D
         test = pickle.loads("".join(sys.stdin.readlines()))
-
-        watchdog = Timer(interval=test.timeout,
-                         function=Tester.timer_fn,
-                         args=(test.crt_iteration, test.num_iterations))
-
-        watchdog.start()
-
-        supervisor = Supervisor(test)
-        supervisor.register_banned_thread(watchdog)
-        supervisor.register_banned_thread()
-        return_code = supervisor.run_testcase()
-
-        watchdog.cancel()
-
-        sys.stdout.flush()
-        sys.stderr.flush()
-        sys.exit(return_code)
+        sys.exit(run_child(test))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,85 @@
+"""
+Per-timepoint timing instrumentation of the simulation.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2018
+"""
+
+import csv
+import json
+from threading import Lock
+
+# Phases timed for each device and timepoint, as indexes in a record
+GET_NEIGHBOURS = 0
+SCRIPT_WAIT = 1
+SCRIPT_RUN = 2
+LOCK_WAIT = 3
+BARRIER_WAIT = 4
+PHASES = ["get_neighbours", "script_wait", "script_run", "lock_wait", "barrier_wait"]
+
+
+class TimingRecorder(object):
+    """
+    Accumulates the time spent by each device in each phase of a timepoint. Devices only
+    call it when instrumentation is enabled, so a disabled run pays a single None check
+    per measurement point.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        # (device_id, time_point) -> seconds spent in each phase
+        self.records = {}
+
+    def add(self, device_id, time_point, phase, seconds):
+        """
+        Adds time spent in a phase.
+
+        @type device_id: Integer
+        @param device_id: the device
+        @type time_point: Integer
+        @param time_point: the timepoint
+        @type phase: Integer
+        @param phase: one of the phase indexes defined by this module
+        @type seconds: Float
+        @param seconds: the time spent
+        """
+        key = (device_id, time_point)
+        with self.lock:
+            record = self.records.get(key)
+            if record is None:
+                record = self.records[key] = [0.0] * len(PHASES)
+            record[phase] += seconds
+
+    def rows(self):
+        """
+        Returns the records sorted by device and timepoint.
+
+        @rtype: List of Dict
+        @return: one dict per record, with device, time_point and a key per phase
+        """
+        with self.lock:
+            items = sorted(self.records.items())
+        rows = []
+        for ((device_id, time_point), record) in items:
+            row = dict(zip(PHASES, record))
+            row["device"] = device_id
+            row["time_point"] = time_point
+            rows.append(row)
+        return rows
+
+    def dump(self, filename):
+        """
+        Writes the records as JSON if the file name ends in .json, as CSV otherwise.
+
+        @type filename: String
+        @param filename: the output file
+        """
+        fields = ["device", "time_point"] + PHASES
+        with open(filename, "w") as out_file:
+            if filename.endswith(".json"):
+                json.dump(self.rows(), out_file, indent=2, sort_keys=True)
+            else:
+                writer = csv.DictWriter(out_file, fields)
+                writer.writerow(dict(zip(fields, fields)))
+                writer.writerows(self.rows())
@@ -0,0 +1,82 @@
+"""
+Leveled trace logging for the simulation, buffered per thread.
+
+Messages are kept unformatted in a bounded ring buffer of the logging thread and are only
+formatted and written, ordered by time, when flush is called at the end of the run. With
+the default level OFF, logging costs one comparison.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2018
+"""
+
+import sys
+from collections import deque
+from threading import current_thread, local, Lock
+from time import time
+
+OFF = 0
+INFO = 1
+DEBUG = 2
+LEVELS = {"off" : OFF, "info" : INFO, "debug" : DEBUG}
+
+_state = {"level" : OFF, "buffer_size" : 10000}
+_local = local()
+_buffers = []
+_buffers_lock = Lock()
+
+
+def set_level(name, buffer_size=10000):
+    """
+    Sets which messages are kept.
+
+    @type name: String
+    @param name: "off", "info" or "debug"
+    @type buffer_size: Integer
+    @param buffer_size: the number of messages kept by each thread; older ones are dropped
+    """
+    if name not in LEVELS:
+        raise StandardError("Wrong log level: %s" % name)
+    _state["level"] = LEVELS[name]
+    _state["buffer_size"] = buffer_size
+
+
+def log(level, message, *args):
+    """
+    Records a message, if its level is enabled.
+
+    @type level: Integer
+    @param level: INFO or DEBUG
+    @type message: String
+    @param message: the message's format string, applied to args when flushed
+    """
+    if level > _state["level"]:
+        return
+    buf = getattr(_local, "buffer", None)
+    if buf is None:
+        buf = _local.buffer = deque(maxlen=_state["buffer_size"])
+        with _buffers_lock:
+            _buffers.append((current_thread().name, buf))
+    buf.append((time(), message, args))
+
+
+def flush(out_file=None):
+    """
+    Writes the buffered messages of all the threads, ordered by time, and empties the
+    buffers. Call it once the logging threads are done.
+
+    @type out_file: File
+    @param out_file: where to write, defaults to stdout
+    """
+    if out_file is None:
+        out_file = sys.stdout
+    with _buffers_lock:
+        records = []
+        for (thread_name, buf) in _buffers:
+            records.extend((stamp, thread_name, message, args)
+                           for (stamp, message, args) in buf)
+            buf.clear()
+    records.sort()
+    for (stamp, thread_name, message, args) in records:
+        out_file.write("%.6f [%s] %s\n" % (stamp, thread_name, message % args))
+    out_file.flush()